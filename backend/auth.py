@@ -1,5 +1,5 @@
 """
-认证与授权：JWT 签发/校验、密码哈希、get_current_user / get_current_admin 依赖。
+认证与授权：JWT 签发/校验、密码哈希、get_current_user / get_current_admin / get_owned_presentation 依赖。
 """
 import os
 from datetime import datetime, timezone, timedelta
@@ -11,8 +11,9 @@ import bcrypt
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import SessionLocal, get_db
 from models import User, Admin
+from repository import get_presentation_meta
 
 # 从环境变量读取，默认仅开发用
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "geekai-ppt-dev-secret-change-in-production")
@@ -70,6 +71,50 @@ def get_current_user(
     return user
 
 
+def get_current_user_for_stream(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(scheme),
+    db: Session = Depends(get_db),
+) -> User:
+    """SSE 专用：EventSource 无法设置请求头，允许通过 ?token= 传递用户 token。"""
+    if not credentials and token:
+        raw = token[7:] if token.startswith("Bearer ") else token
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=raw)
+    return get_current_user(credentials=credentials, db=db)
+
+
+def get_owned_presentation(
+    presentation_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+) -> dict:
+    """
+    校验路径中的演示文稿属于当前用户，返回其标量字段（不含幻灯片）；不存在或不属于当前用户时 404。
+    FastAPI 在同一请求内缓存依赖结果，路由与其他依赖重复声明时只查询一次。
+    """
+    pres = get_presentation_meta(db, presentation_id, user_id=current_user.id)
+    if not pres:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Presentation not found")
+    return pres
+
+
+def get_owned_presentation_for_stream(
+    presentation_id: str,
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(scheme),
+) -> dict:
+    """
+    SSE 专用的归属校验（支持 ?token=）。
+    在独立的短会话中校验后立即关闭：请求级会话（get_db）要到响应结束才释放，SSE 会占住连接池中的连接长达数分钟。
+    """
+    db = SessionLocal()
+    try:
+        current_user = get_current_user_for_stream(token=token, credentials=credentials, db=db)
+        return get_owned_presentation(presentation_id, current_user=current_user, db=db)
+    finally:
+        db.close()
+
+
 def get_current_admin(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(scheme),
     db: Session = Depends(get_db),
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+多 worker 吞吐基准：依次以不同 worker 数启动 uvicorn，对同一接口并发压测，输出每秒请求数。
+
+用法（在 backend 目录执行）：
+    python bench_workers.py --workers 1 2 4 --duration 10 --concurrency 64 --path /gallery
+
+压测客户端与服务端运行在同一台机器上，会占用一部分 CPU，结果用于比较不同 worker 数的相对扩展性。
+worker 数超过 CPU 核数的行以 * 标出：这些进程争用同一批核心，结果不能说明扩展性，需在核数足够的机器上重跑。
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+
+async def _wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.3)
+    raise RuntimeError(f"server not ready: {url}")
+
+
+async def _load(url: str, duration: float, concurrency: int) -> dict:
+    ok = errors = 0
+    latencies = []
+    stop_at = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def worker():
+            nonlocal ok, errors
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                try:
+                    async with session.get(url) as resp:
+                        await resp.read()
+                        if resp.status == 200:
+                            ok += 1
+                        else:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    return {"rps": ok / elapsed, "ok": ok, "errors": errors, "p50_ms": p50 * 1000, "p99_ms": p99 * 1000}
+
+
+def run(workers: int, port: int, path: str, duration: float, concurrency: int) -> dict:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(_wait_ready(base + "/"))
+        # 预热：让每个 worker 完成导入与连接建立
+        asyncio.run(_load(base + path, 2, concurrency))
+        return asyncio.run(_load(base + path, duration, concurrency))
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="uvicorn 多 worker 吞吐基准")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8092)
+    parser.add_argument("--path", default="/gallery")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"cpus={cpus} path={args.path} duration={args.duration}s concurrency={args.concurrency}")
+    if max(args.workers) > cpus:
+        print(f"warning: only {cpus} CPU(s) available; rows marked * have more workers than CPUs and do not measure scaling")
+    print(f"{'workers':>8} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for n in args.workers:
+        r = run(n, args.port, args.path, args.duration, args.concurrency)
+        mark = " *" if n > cpus else ""
+        print(f"{n:>8} {r['rps']:>10.1f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['errors']:>7}{mark}")
+
+
+if __name__ == "__main__":
+    main()
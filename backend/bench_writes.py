@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+并发生成写入基准：在临时 SQLite 文件库上模拟多个生成任务同时写入「新版本 + 积分结算」，
+比较各线程自行提交（direct）与经单写者队列组提交（queue）的每秒提交版本数，同时由读线程测量读延迟。
+
+用法（在 backend 目录执行，不会触碰 storage/presentations.db）：
+    python bench_writes.py --threads 1 4 8 16 --slides 100 --readers 2
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import models
+from database import Base, _set_sqlite_pragmas
+from repository import (
+    _add_slide_version,
+    _settle_reserved_scores,
+    add_slide_version,
+    create_presentation,
+    get_presentation,
+    reserve_scores,
+    settle_reserved_scores,
+)
+from write_queue import WriteQueue
+
+
+def _setup(path: str, threads: int, slides: int):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False}, pool_size=threads + 8)
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    db = Session()
+    try:
+        db.add(models.User(id="bench", username="bench", password_hash="x", scores=threads * slides))
+        db.commit()
+        jobs = []
+        for t in range(threads):
+            pid = create_presentation(db, topic=f"bench {t}", user_id="bench")
+            jobs.append((pid, reserve_scores(db, "bench", slides, presentation_id=pid)))
+    finally:
+        db.close()
+    return engine, Session, jobs
+
+
+def _reader(Session, pids, stop: threading.Event, latencies: list) -> None:
+    n = 0
+    while not stop.is_set():
+        db = Session()
+        try:
+            start = time.perf_counter()
+            get_presentation(db, pids[n % len(pids)], view="summary")
+            latencies.append(time.perf_counter() - start)
+        finally:
+            db.close()
+        n += 1
+
+
+def run(mode: str, threads: int, slides: int, readers: int) -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench-writes-")
+    engine, Session, jobs = _setup(os.path.join(tmp, "bench.db"), threads, slides)
+    writer = WriteQueue(session_factory=Session) if mode == "queue" else None
+    errors = []
+
+    def generate(pid: str, reservation_id: str) -> None:
+        db = Session()
+        try:
+            for i in range(slides):
+                image_path = f"/images/{pid}/{i}.png"
+                try:
+                    if writer is not None:
+                        def op(wdb, i=i, image_path=image_path):
+                            _add_slide_version(wdb, pid, i, image_path=image_path, prompt="p")
+                            return _settle_reserved_scores(wdb, reservation_id, "bench", 1, prompt="p", image_path=image_path)
+                        writer.run(op)
+                    else:
+                        # 改造前的写法：每页各自提交版本与结算
+                        add_slide_version(db, pid, i, image_path=image_path, prompt="p")
+                        settle_reserved_scores(db, reservation_id, "bench", 1, prompt="p", image_path=image_path)
+                except OperationalError as e:
+                    db.rollback()
+                    errors.append(str(e.orig))
+        finally:
+            db.close()
+
+    stop = threading.Event()
+    latencies = []
+    reader_threads = [
+        threading.Thread(target=_reader, args=(Session, [pid for pid, _ in jobs], stop, latencies))
+        for _ in range(readers)
+    ]
+    writer_threads = [threading.Thread(target=generate, args=job) for job in jobs]
+    for t in reader_threads:
+        t.start()
+    started = time.perf_counter()
+    for t in writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for t in reader_threads:
+        t.join()
+
+    with engine.connect() as conn:
+        versions = conn.exec_driver_sql("SELECT COUNT(*) FROM slide_versions").scalar()
+    if writer is not None:
+        writer.close()
+    engine.dispose()
+    shutil.rmtree(tmp, ignore_errors=True)
+    latencies.sort()
+    return {
+        "versions_per_s": versions / elapsed,
+        "versions": versions,
+        "errors": len(errors),
+        "commits": writer.commits if writer is not None else versions * 2,
+        "read_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发生成写入基准（direct 与 queue 对比）")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8, 16], help="同时生成的演示文稿数")
+    parser.add_argument("--slides", type=int, default=100, help="每个演示文稿生成的页数")
+    parser.add_argument("--readers", type=int, default=2, help="并发读线程数")
+    parser.add_argument("--modes", nargs="+", default=["direct", "queue"], choices=["direct", "queue"])
+    args = parser.parse_args()
+
+    print(f"slides/thread={args.slides} readers={args.readers}")
+    print(f"{'mode':>7} {'threads':>8} {'versions/s':>11} {'commits':>8} {'errors':>7} {'read p99 ms':>12}")
+    for n in args.threads:
+        for mode in args.modes:
+            r = run(mode, n, args.slides, args.readers)
+            print(f"{mode:>7} {n:>8} {r['versions_per_s']:>11.1f} {r['commits']:>8} {r['errors']:>7} {r['read_p99_ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
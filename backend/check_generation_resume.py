@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+生成续跑检查：在临时 SQLite 文件库上跑一次中途有页失败的批量生成，再以入队时的大纲续跑
+（与任务被其他 worker 接手时相同，已生成的页由 outline_items 状态恢复），检查每个大纲条目各自关联一张幻灯片、
+幻灯片顺序与大纲顺序一致、续跑补生成的页没有顶替后面已生成的页；不一致即以非零状态退出。
+
+用法（在 backend 目录执行，CI 中运行；不会触碰 storage/presentations.db）：
+    python check_generation_resume.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="resume-check-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'resume.db')}"
+
+import generation  # noqa: E402
+import repository as repo  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+
+PAGES = 4
+
+
+class _Bus:
+    def publish(self, channel, event, payload):
+        pass
+
+
+class _ImageGen:
+    """按 visual_subject 返回图片地址；failing 中的页返回空（生成失败，跳过该页）。"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+
+    def generate_slide_image_from_plan(self, slide_data, global_style_prompt="", presentation_mode="slides"):
+        subject = slide_data["visual_subject"]
+        return None if subject in self.failing else f"/images/{subject}.png"
+
+
+def _run(pid: str, slides: list, image_gen) -> str:
+    return generation.run_generation(pid, slides, None, image_gen, _Bus())
+
+
+def _check(db, pid: str) -> list:
+    """返回发现的问题：条目与幻灯片一一对应，且幻灯片顺序即大纲顺序。"""
+    problems = []
+    items = repo.list_outline_items(db, pid, with_status=True)
+    pending = [item["index"] for item in items if item["status"] != "generated"]
+    if pending:
+        problems.append(f"items not generated: {pending}")
+    slide_ids = [item["slide_id"] for item in items]
+    if len(set(slide_ids)) != len(slide_ids):
+        problems.append(f"items share slides: {slide_ids}")
+    deck = repo.get_presentation(db, pid, view="full")["slides"]
+    prompts = [
+        next(v["prompt"] for v in slide["versions"] if v["id"] == slide["active_version_id"]) for slide in deck
+    ]
+    expected = [f"page {i}" for i in range(PAGES)]
+    if prompts != expected:
+        problems.append(f"deck order {prompts}, expected {expected}")
+    return problems
+
+
+def main() -> int:
+    Base.metadata.create_all(bind=engine)
+    generation.save_image_locally_sync = lambda url, session_id=None: url
+    db = SessionLocal()
+    try:
+        pid = repo.create_presentation(db, topic="resume check")
+        outline = [{"title": f"p{i}", "visual_subject": f"page {i}"} for i in range(PAGES)]
+        repo.replace_outline_items(db, pid, outline)
+        first = _run(pid, [dict(item) for item in outline], _ImageGen(failing={"page 1"}))
+        resumed = _run(pid, [dict(item) for item in outline], _ImageGen())
+        db.expire_all()
+        problems = _check(db, pid)
+        if first != "failed" or resumed != "completed":
+            problems.append(f"statuses {first!r} / {resumed!r}, expected 'failed' / 'completed'")
+    finally:
+        db.close()
+        generation.write_queue.close()
+        engine.dispose()
+        shutil.rmtree(_TMP_DIR, ignore_errors=True)
+    for problem in problems:
+        print(problem)
+    print(f"resume after partial failure: {'FAILED' if problems else 'OK'}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+热点查询执行计划检查：在内存 SQLite 库上按 models 建表并写入少量样例数据，调用 repository 中的热点读写函数，
+对捕获到的每条 SELECT / UPDATE / DELETE 执行 EXPLAIN QUERY PLAN；出现未使用索引的全表扫描即以非零状态退出。
+
+用法（在 backend 目录执行，CI 中运行）：
+    python check_query_plans.py        # 只输出有问题的语句
+    python check_query_plans.py -v     # 输出每条语句的执行计划
+    python check_query_plans.py --database-url postgresql://postgres@localhost:5432/ci
+        # 在指定的空库上执行同一组热点读写，验证 repository 在该数据库上可用；执行计划检查只针对 SQLite
+
+后台管理的全量列表（list_all_presentations_admin 等）本就需要扫全表，不在检查范围内。
+"""
+import argparse
+import re
+import sys
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+import models  # noqa: F401 - 注册 ORM 到 Base.metadata
+import repository as repo
+
+# 「SCAN presentations」「SCAN TABLE slides AS s」为全表扫描；带 USING INDEX / COVERING INDEX / PRIMARY KEY 的不算
+_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+
+def _exercise_hot_queries(db) -> None:
+    """按 API 的典型调用顺序执行一遍热点查询。"""
+    user_id = "u1"
+    db.add(models.User(id=user_id, username="checker", password_hash="x", scores=100))
+    db.commit()
+    pids = [repo.create_presentation(db, topic=f"topic {i}", user_id=user_id) for i in range(3)]
+    pid = pids[0]
+    for index in range(4):
+        for n in range(2):
+            repo.add_slide_version(db, pid, index, image_path=f"/images/{pid}/{index}-{n}.png", prompt="p")
+    repo.insert_slide_at_index(db, pid, 1, image_path=f"/images/{pid}/ins.png", prompt="p")
+
+    repo.list_presentations(db, user_id=user_id)
+    repo.get_presentation_meta(db, pid, user_id=user_id)
+    repo.get_presentation(db, pid, user_id=user_id, view="summary")
+    repo.get_presentation(db, pid, user_id=user_id, view="full")
+    repo.get_generation_progress(db, pid)
+    repo.replace_outline_items(db, pid, [{"title": "a"}, {"title": "b", "_generated": True}])
+    repo._add_outline_item_slide_version(db, pid, 0, image_path=f"/images/{pid}/o.png", prompt="p")
+    repo._mark_outline_item_generated(db, pid, 0, None)
+    db.commit()
+    repo.list_outline_items(db, pid, with_status=True)
+    repo.list_generated_outline_indexes(db, pid)
+    repo.update_generation_progress(db, pid, "generating", 1, 4)
+    repo.update_generation_progress_many(db, {p: ("generating", 2, 4, None) for p in pids})
+
+    slide = repo.get_slide_by_position(db, pid, 0)
+    repo.get_slide_by_id(db, pid, slide.id)
+    repo.add_slide_version_by_slide_id(db, pid, slide.id, image_path=f"/images/{pid}/v.png", prompt="p")
+    repo.set_slide_active_version(db, pid, slide.id, slide.versions[0].id)
+    repo.delete_slide_by_id(db, pid, slide.id)
+    repo.list_deleted_slides(db, pid)
+    repo.restore_slide(db, pid, slide.id)
+    repo.move_slide(db, pid, slide.id, 3)
+    repo.get_previous_slide_prompt(db, pid, slide_id=slide.id)
+    repo.get_previous_slide_prompt(db, pid, current_position=2)
+
+    for p in pids:
+        repo.set_presentation_published(db, p, True)
+    items, cursor = repo.list_published_presentations(db, limit=2)
+    repo.list_published_presentations(db, limit=2, cursor=cursor)
+    repo.get_presentation_public(db, pid)
+
+    repo.delete_presentation(db, pids[2])
+    repo.list_deleted_presentations(db, user_id=user_id)
+
+    reservation_id = repo.reserve_scores(db, user_id, 4, presentation_id=pid)
+    repo.get_credit_reservation(db, reservation_id)
+    repo.settle_reserved_scores(db, reservation_id, user_id, 1, balance=99, prompt="p")
+    repo.deduct_scores(db, user_id, 1)
+
+    repo.enqueue_generation_job(db, pid, [{"title": "a"}], user_id, reservation_id=reservation_id)
+    job = repo.lease_generation_job(db, "checker", 60)
+    repo.renew_generation_job(db, job["id"], "checker", 60)
+    repo.release_reserved_scores(db, reservation_id)
+    repo.touch_credit_reservations(db, [reservation_id])
+    repo.release_stale_reservations(db, 0)
+    repo.release_stale_reservations(db, 0, exclude_ids=[reservation_id])
+    repo.list_score_logs_by_user(db, user_id)
+
+
+def _exercise_database(url: str) -> int:
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        _exercise_hot_queries(db)
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+    print(f"hot queries executed on {engine.dialect.name}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="检查 repository 热点查询是否走索引")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出每条语句的执行计划")
+    parser.add_argument("--database-url", help="在该数据库（须为空库）上执行热点读写，不检查执行计划")
+    args = parser.parse_args()
+
+    if args.database_url:
+        return _exercise_database(args.database_url)
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _capture(_conn, _cursor, statement, parameters, _context, executemany):
+        if statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE"):
+            statements.append((statement, parameters[0] if executemany else parameters))
+
+    db = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        _exercise_hot_queries(db)
+    finally:
+        db.close()
+
+    seen = set()
+    failures = 0
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for statement, parameters in statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = [row[3] for row in cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()]
+            # 只关心真实表；子查询展开的 SCAN anon_1 等不算
+            scans = [
+                line for line in plan
+                if (m := _FULL_SCAN.match(line.strip())) and m.group(1) in Base.metadata.tables
+            ]
+            if scans:
+                failures += 1
+            if scans or args.verbose:
+                print(("FULL SCAN" if scans else "ok") + ": " + " ".join(statement.split())[:200])
+                for line in plan:
+                    print("    " + line)
+    finally:
+        raw.close()
+
+    print(f"{len(seen)} distinct statements checked, {failures} with full table scans")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
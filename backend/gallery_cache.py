@@ -0,0 +1,125 @@
+"""
+作品广场读穿缓存：/gallery 列表页与 /gallery/{id} 详情页。
+
+- 缓存条目放在 GALLERY_CACHE_URL 指定的状态存储（默认进程内存，可配置 redis:// 等共享）；
+- 失效用「代号」实现：列表共用一个代号，每个演示文稿的详情各有一个代号，代号存放在共享状态存储中，
+  数据变更提交后换新代号，所有 worker 的旧条目随即不可达；
+- 条目过了新鲜期（GALLERY_CACHE_TTL）仍可在陈旧期（GALLERY_CACHE_STALE）内直接返回，同时后台刷新；
+- 每个条目带 ETag，供浏览器与 CDN 以 If-None-Match 低成本校验。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from state_store import StateStore
+
+FRESH_SECONDS = int(os.getenv("GALLERY_CACHE_TTL", "30"))
+STALE_SECONDS = int(os.getenv("GALLERY_CACHE_STALE", "300"))
+
+ENTRY_NAMESPACE = "gallery_cache"
+GEN_NAMESPACE = "gallery_gen"
+LIST_GEN = "list"
+
+
+def make_etag(body) -> str:
+    raw = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+class GalleryCache:
+    """
+    get_list / get_detail 返回 {"body", "etag"}，loader(db) 返回 None 时不缓存并返回 None。
+    invalidate(presentation_id, list_changed) 由提交钩子调用。
+    """
+
+    def __init__(self, entries: StateStore, generations: StateStore, fresh: int = FRESH_SECONDS, stale: int = STALE_SECONDS):
+        self.entries = entries
+        self.generations = generations
+        self.fresh = fresh
+        self.stale = stale
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gallery-cache")
+
+    def _generation(self, name: str) -> str:
+        return self.generations.get(GEN_NAMESPACE, name) or "0"
+
+    def get_list(self, db: Session, cursor: Optional[str], skip: int, limit: int, loader: Callable[[Session], Optional[dict]]) -> Optional[dict]:
+        key = f"list:{self._generation(LIST_GEN)}:{cursor or ''}:{skip}:{limit}"
+        return self._read_through(db, key, loader)
+
+    def get_detail(self, db: Session, presentation_id: str, loader: Callable[[Session], Optional[dict]]) -> Optional[dict]:
+        key = f"detail:{presentation_id}:{self._generation('detail:' + presentation_id)}"
+        return self._read_through(db, key, loader)
+
+    def _read_through(self, db: Session, key: str, loader) -> Optional[dict]:
+        entry = self.entries.get(ENTRY_NAMESPACE, key)
+        if entry is not None:
+            if entry["fresh_until"] < time.time():
+                self._schedule_refresh(key, loader)
+            return entry
+        body = loader(db)
+        if body is None:
+            return None
+        return self._store(key, body)
+
+    def _store(self, key: str, body: dict) -> dict:
+        entry = {"body": body, "etag": make_etag(body), "fresh_until": time.time() + self.fresh}
+        self.entries.set(ENTRY_NAMESPACE, key, entry, ttl=self.fresh + self.stale)
+        return entry
+
+    def _schedule_refresh(self, key: str, loader) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key, loader)
+
+    def _refresh(self, key: str, loader) -> None:
+        """后台刷新：期间若发生失效，新条目写在旧代号下，不会被读到。"""
+        db = SessionLocal()
+        try:
+            body = loader(db)
+            if body is None:
+                self.entries.delete(ENTRY_NAMESPACE, key)
+            else:
+                self._store(key, body)
+        except Exception as e:
+            print(f"Gallery cache refresh failed for {key}: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, presentation_id: str, list_changed: bool = False) -> None:
+        self.generations.set(GEN_NAMESPACE, "detail:" + presentation_id, uuid.uuid4().hex)
+        if list_changed:
+            self.generations.set(GEN_NAMESPACE, LIST_GEN, uuid.uuid4().hex)
+
+
+def install_invalidation(cache: GalleryCache) -> None:
+    """注册会话提交钩子：repository 在事务中记录的公开内容变更，在提交成功后精确失效缓存。"""
+
+    @event.listens_for(SessionLocal, "after_commit")
+    def _after_commit(session):
+        changes = session.info.pop("public_changes", None)
+        if not changes:
+            return
+        for presentation_id, list_changed in changes.items():
+            try:
+                cache.invalidate(presentation_id, list_changed)
+            except Exception as e:
+                print(f"Gallery cache invalidate failed for {presentation_id}: {e}")
+
+    @event.listens_for(SessionLocal, "after_rollback")
+    def _after_rollback(session):
+        session.info.pop("public_changes", None)
@@ -0,0 +1,204 @@
+"""
+批量生成流水线：按序生成每张幻灯片、写入版本、从受理时冻结的积分预留中结算并发布进度。
+每页的版本、结算与大纲条目状态经单写者队列（write_queue）与并发任务的写入合并提交。
+API 进程（本地队列）与独立 worker（数据库队列）共用同一实现。
+"""
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from progress_writer import ProgressWriter
+from repository import (
+    _add_outline_item_slide_version,
+    _settle_reserved_scores,
+    _mark_outline_item_generated,
+    list_generated_outline_indexes,
+    get_version_slide_id,
+    get_user_scores,
+    deduct_scores,
+    get_scores_per_slide,
+    record_score_log,
+    get_credit_reservation,
+    release_reserved_scores,
+)
+from utils import save_image_locally_sync
+from write_queue import WriteQueue
+
+GENERATION_TERMINAL_EVENTS = ("completed", "failed")
+
+# 本进程内所有生成任务共用的进度写回缓冲与单写者队列
+progress_writer = ProgressWriter()
+write_queue = WriteQueue()
+
+
+def _is_generatable(slide: dict) -> bool:
+    return bool(
+        slide.get("visual_prompt") or slide.get("prompt") or slide.get("visual_subject") or slide.get("global_style_prompt") or ""
+    )
+
+
+def set_generation_progress(
+    bus,
+    db: Session,
+    presentation_id: str,
+    status: str,
+    current: int = 0,
+    total: int = 0,
+    error: Optional[str] = None,
+    write_through: bool = False,
+) -> bool:
+    """
+    推送生成进度给 generation-stream 订阅方；completed/failed 作为终止事件发布。
+    终止状态或 write_through=True（受理任务时）立即落库，其余进度交给 progress_writer 合并后定时写入。
+    """
+    if write_through or status in GENERATION_TERMINAL_EVENTS:
+        ok = progress_writer.write_through(db, presentation_id, status, current, total, error=error)
+    else:
+        progress_writer.write(presentation_id, status, current, total, error=error)
+        ok = True
+    payload = {
+        "status": status,
+        "current": current,
+        "total": total,
+        "percentage": int((current / total) * 100) if total > 0 else 0,
+    }
+    if error:
+        payload["error"] = error
+    event = status if status in GENERATION_TERMINAL_EVENTS else "progress"
+    bus.publish(f"generation:{presentation_id}", event, payload)
+    return ok
+
+
+def run_generation(
+    presentation_id: str,
+    slides: list,
+    user_id: Optional[str],
+    image_gen,
+    bus,
+    on_slide_done: Optional[Callable[[], None]] = None,
+    reservation_id: Optional[str] = None,
+) -> str:
+    """
+    按序生成每张幻灯片，并更新进度。每成功生成一张结算 user 积分（若已登录）：
+    有 reservation_id 时从受理时冻结的预留中结算（每页一次写入），结束时退回未用部分；
+    预留不足或没有预留时退回到直接扣减。
+    slides 的下标即大纲条目序号（outline_items.item_index），每生成一页把对应条目标记为已生成并关联幻灯片；
+    幻灯片按条目关联定位（见 _add_outline_item_slide_version），续跑时补生成的页插在前一页之后，不会覆盖后面已生成的页；
+    开始时按 outline_items.status 重建各页的 _generated 标记，已生成的页跳过并计入已完成数
+    （续跑已生成的大纲，或任务被其他 worker 接手时）；每完成一页调用 on_slide_done() 以便队列续租。
+    返回最终状态 completed / failed。
+    """
+    db = SessionLocal()
+    scores_per_slide = get_scores_per_slide(db) if user_id else 0
+    # 日志中的余额按「逐页扣减」口径在内存中推算：当前余额 + 预留中尚未结算的部分
+    balance = None
+    if reservation_id and user_id and scores_per_slide > 0:
+        reservation = get_credit_reservation(db, reservation_id)
+        if reservation and reservation["status"] == "held":
+            balance = get_user_scores(db, user_id) + reservation["reserved"] - reservation["consumed"]
+    try:
+        generated = list_generated_outline_indexes(db, presentation_id)
+        for i, item in enumerate(slides):
+            if i in generated:
+                item["_generated"] = True
+            else:
+                item.pop("_generated", None)
+        total = len([s for s in slides if _is_generatable(s)])
+        if total == 0:
+            set_generation_progress(bus, db, presentation_id, "completed", 0, 0)
+            return "completed"
+        prev_prompt = None
+        completed = len([s for s in slides if s.get("_generated") and _is_generatable(s)])
+        for i, item in enumerate(slides):
+            if item.get("_generated"):
+                prev_prompt = item.get("visual_prompt") or item.get("prompt") or item.get("visual_subject") or prev_prompt
+                continue
+            prompt = item.get("visual_prompt") or item.get("prompt") or ""
+            has_plan_fields = bool(item.get("visual_subject")) or bool(item.get("global_style_prompt"))
+            if not prompt and not has_plan_fields:
+                continue
+            try:
+                if has_plan_fields:
+                    image_url = image_gen.generate_slide_image_from_plan(
+                        slide_data=item,
+                        global_style_prompt=item.get("global_style_prompt", ""),
+                        presentation_mode=item.get("presentation_mode", "slides"),
+                    )
+                else:
+                    image_url = image_gen.generate_slide_image(
+                        prompt=prompt,
+                        reference_style_prompt=prev_prompt,
+                    )
+                if not image_url:
+                    continue
+                local_path = save_image_locally_sync(image_url, session_id=presentation_id)
+                if not local_path:
+                    continue
+                version_prompt = prompt
+                if has_plan_fields and not prompt:
+                    version_prompt = item.get("visual_subject", "") or "Generated from plan"
+                settle = user_id and scores_per_slide > 0 and balance is not None
+
+                def _write_slide(wdb: Session, i=i, local_path=local_path, version_prompt=version_prompt, settle=settle, balance=balance):
+                    # 新版本、积分结算与大纲条目状态作为一个写操作，由单写者队列与其他任务的写入合并提交
+                    version_id = _add_outline_item_slide_version(wdb, presentation_id, i, image_path=local_path, prompt=version_prompt)
+                    settled = bool(settle) and _settle_reserved_scores(
+                        wdb, reservation_id, user_id, scores_per_slide,
+                        balance=balance - scores_per_slide, prompt=version_prompt, image_path=local_path,
+                    )
+                    wdb.flush()
+                    slide_id = get_version_slide_id(wdb, version_id)
+                    _mark_outline_item_generated(wdb, presentation_id, i, slide_id)
+                    return version_id, slide_id, settled
+
+                version_id, slide_id, settled = write_queue.run(_write_slide)
+                if version_id:
+                    bus.publish(f"generation:{presentation_id}", "slide_done", {
+                        "index": i,
+                        "slide_id": slide_id,
+                        "version_id": version_id,
+                        "image_url": local_path,
+                        "prompt": version_prompt,
+                        "current": completed + 1,
+                        "total": total,
+                    })
+                    if user_id and scores_per_slide > 0:
+                        if settled:
+                            balance -= scores_per_slide
+                        else:
+                            # 没有预留，或预留已用尽、已释放：直接扣减，后续页不再尝试预留
+                            balance = None
+                            if deduct_scores(db, user_id, scores_per_slide):
+                                record_score_log(db, user_id, scores_per_slide, prompt=version_prompt, image_path=local_path)
+                    item["_generated"] = True
+                    completed += 1
+                    set_generation_progress(bus, db, presentation_id, "generating", completed, total)
+                    if on_slide_done is not None:
+                        on_slide_done()
+                prev_prompt = prompt or item.get("visual_subject") or prev_prompt
+            except Exception as e:
+                set_generation_progress(
+                    bus, db, presentation_id, "failed", completed, total, error=str(e)
+                )
+                return "failed"
+        if completed >= total:
+            set_generation_progress(bus, db, presentation_id, "completed", completed, total)
+            return "completed"
+        set_generation_progress(bus, db, presentation_id, "failed", completed, total, error="Generation interrupted")
+        return "failed"
+    except Exception as e:
+        try:
+            set_generation_progress(
+                bus, db, presentation_id, "failed", 0, len(slides), error=str(e)
+            )
+        except Exception:
+            pass
+        return "failed"
+    finally:
+        if reservation_id:
+            try:
+                release_reserved_scores(db, reservation_id)
+            except Exception as e:
+                print(f"Release credit reservation {reservation_id} failed: {e}")
+        db.close()
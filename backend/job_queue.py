@@ -0,0 +1,203 @@
+"""
+生成任务队列：API 入队，执行方领取任务并运行生成流水线（generation.run_generation）。
+
+GENERATION_QUEUE 选择实现：
+- local（默认）：进程内替身 broker，任务在 API 进程的线程池中执行，不落库；
+- db：任务写入 generation_jobs 表，由独立的 worker.py 进程以租约方式领取，可与 API 分开扩容。
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from database import SessionLocal
+from generation import run_generation, set_generation_progress
+from repository import (
+    enqueue_generation_job,
+    release_reserved_scores,
+    release_stale_reservations,
+    touch_credit_reservations,
+    lease_generation_job,
+    renew_generation_job,
+    finish_generation_job,
+    list_generated_outline_indexes,
+)
+
+# 租约时长（秒）：持有方每 1/3 租约续租一次，进程崩溃后租约过期，任务由其他 worker 续跑
+LEASE_SECONDS = int(os.getenv("GENERATION_LEASE_SECONDS", "300"))
+# 同一任务最多被领取的次数，超过后标记失败
+MAX_ATTEMPTS = int(os.getenv("GENERATION_MAX_ATTEMPTS", "3"))
+# 积分预留超过该时长（秒）无结算、且没有排队或执行中的任务引用时，视为执行进程崩溃遗留，退回用户
+CREDIT_HOLD_TTL_SECONDS = int(os.getenv("CREDIT_HOLD_TTL_SECONDS", "3600"))
+# 过期积分预留的清扫间隔（秒），API 与 worker 进程各自定时清扫
+CREDIT_HOLD_SWEEP_SECONDS = float(os.getenv("CREDIT_HOLD_SWEEP_SECONDS", "300"))
+
+# 本进程本地队列中排队或执行中的任务所用的积分预留：本地队列不写 generation_jobs，
+# 清扫时跳过这些预留并刷新其 updated_at，其他进程的清扫也不会把它们当作遗留退回
+_active_reservations = set()
+_active_reservations_lock = threading.Lock()
+
+
+class LocalJobQueue:
+    """进程内替身 broker：任务直接提交到本进程线程池，同时运行的演示文稿数不超过 max_workers。"""
+
+    def __init__(self, image_gen, bus, max_workers: int = 4):
+        self.image_gen = image_gen
+        self.bus = bus
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+
+    def enqueue(
+        self, presentation_id: str, slides: list, user_id: Optional[str] = None, reservation_id: Optional[str] = None
+    ) -> str:
+        job_id = str(uuid.uuid4())
+        if reservation_id:
+            with _active_reservations_lock:
+                _active_reservations.add(reservation_id)
+        try:
+            self._executor.submit(self._run, presentation_id, slides, user_id, reservation_id)
+        except BaseException:
+            _discard_active_reservation(reservation_id)
+            raise
+        return job_id
+
+    def _run(self, presentation_id: str, slides: list, user_id: Optional[str], reservation_id: Optional[str]) -> None:
+        try:
+            run_generation(presentation_id, slides, user_id, self.image_gen, self.bus, reservation_id=reservation_id)
+        except Exception as e:
+            print(f"Generation job for {presentation_id} crashed: {e}")
+        finally:
+            _discard_active_reservation(reservation_id)
+
+
+def _discard_active_reservation(reservation_id: Optional[str]) -> None:
+    if reservation_id:
+        with _active_reservations_lock:
+            _active_reservations.discard(reservation_id)
+
+
+class DBJobQueue:
+    """数据库队列：enqueue 只写入 generation_jobs；run_one 由 worker 调用，领取并执行一条任务。"""
+
+    def __init__(self, lease_seconds: int = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(
+        self, presentation_id: str, slides: list, user_id: Optional[str] = None, reservation_id: Optional[str] = None
+    ) -> str:
+        db = SessionLocal()
+        try:
+            return enqueue_generation_job(db, presentation_id, slides, user_id, reservation_id=reservation_id)
+        finally:
+            db.close()
+
+    def run_one(self, owner: str, image_gen, bus) -> bool:
+        """领取并执行一条任务；队列为空时返回 False。"""
+        db = SessionLocal()
+        try:
+            job = lease_generation_job(db, owner, self.lease_seconds)
+            if job is None:
+                return False
+            if job["attempts"] > self.max_attempts:
+                error = f"Generation job abandoned after {self.max_attempts} attempts"
+                finish_generation_job(db, job["id"], owner, "failed", error=error)
+                if job["reservation_id"]:
+                    release_reserved_scores(db, job["reservation_id"])
+                done = len(list_generated_outline_indexes(db, job["presentation_id"]))
+                set_generation_progress(bus, db, job["presentation_id"], "failed", done, len(job["slides"]), error=error)
+                return True
+        finally:
+            db.close()
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], owner, stop), daemon=True)
+        heartbeat.start()
+        status, error = "failed", None
+        try:
+            status = run_generation(
+                job["presentation_id"],
+                job["slides"],
+                job["user_id"],
+                image_gen,
+                bus,
+                on_slide_done=lambda: self._renew_lease(job["id"], owner),
+                reservation_id=job["reservation_id"],
+            )
+        except Exception as e:
+            error = str(e)
+            print(f"Generation job {job['id']} crashed: {e}")
+        finally:
+            stop.set()
+            heartbeat.join()
+            db = SessionLocal()
+            try:
+                finish_generation_job(db, job["id"], owner, status, error=error)
+            finally:
+                db.close()
+        return True
+
+    def _renew_lease(self, job_id: str, owner: str) -> None:
+        # 每完成一页只续租；已生成的页记录在 outline_items 中，不再整段写回 slides
+        db = SessionLocal()
+        try:
+            if not renew_generation_job(db, job_id, owner, self.lease_seconds):
+                print(f"Generation job {job_id}: lease lost by {owner}")
+        finally:
+            db.close()
+
+    def _heartbeat(self, job_id: str, owner: str, stop: threading.Event) -> None:
+        while not stop.wait(self.lease_seconds / 3):
+            db = SessionLocal()
+            try:
+                renew_generation_job(db, job_id, owner, self.lease_seconds)
+            except Exception as e:
+                print(f"Generation job {job_id}: renew lease failed: {e}")
+            finally:
+                db.close()
+
+
+def release_stale_credit_holds() -> int:
+    """
+    退回执行进程崩溃或受理中断后遗留的积分预留，返回释放条数；多个进程同时清扫时每条预留只退一次。
+    先刷新本进程本地队列仍在使用的预留（清扫间隔须小于 CREDIT_HOLD_TTL_SECONDS），再跳过它们清扫。
+    """
+    with _active_reservations_lock:
+        active = list(_active_reservations)
+    db = SessionLocal()
+    try:
+        touch_credit_reservations(db, active)
+        released = release_stale_reservations(db, CREDIT_HOLD_TTL_SECONDS, exclude_ids=active)
+        if released:
+            print(f"Released {released} stale credit reservation(s)")
+        return released
+    finally:
+        db.close()
+
+
+def start_credit_hold_sweeper(stop: Optional[threading.Event] = None) -> threading.Thread:
+    """启动后台清扫线程：立即清扫一次过期积分预留，之后每 CREDIT_HOLD_SWEEP_SECONDS 秒一次，直到 stop 被设置。"""
+    stop = stop or threading.Event()
+
+    def _run() -> None:
+        while True:
+            try:
+                release_stale_credit_holds()
+            except Exception as e:
+                print(f"Release stale credit reservations failed: {e}")
+            if stop.wait(CREDIT_HOLD_SWEEP_SECONDS):
+                return
+
+    thread = threading.Thread(target=_run, name="credit-hold-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def create_generation_queue(image_gen, bus):
+    """根据 GENERATION_QUEUE 创建生成任务队列。"""
+    kind = os.getenv("GENERATION_QUEUE", "local").lower()
+    if kind == "db":
+        return DBJobQueue()
+    if kind == "local":
+        return LocalJobQueue(image_gen, bus, max_workers=int(os.getenv("GENERATION_CONCURRENCY", "4")))
+    raise ValueError(f"Unsupported GENERATION_QUEUE: {kind}")
@@ -1,5 +1,10 @@
 import os
 import json
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -204,25 +209,141 @@ MASTER_SYSTEM_PROMPT = f"""{PPT_CORE_PRINCIPLES}
 """
 
 
+# 规划各阶段名称；轻量阶段默认走 MODEL_FAST，其余走 MODEL_LOGIC
+PLANNER_STAGES = (
+    "keywords", "content", "hook", "structure", "style",
+    "integrate", "repair", "enrich", "insertion", "short_title",
+)
+LIGHT_STAGES = ("keywords", "short_title", "insertion")
+
+
+# 自带 API Key 的客户端池上限（LRU 淘汰）
+CLIENT_POOL_SIZE = int(os.getenv("LLM_CLIENT_POOL_SIZE", "32"))
+# 阶段模型覆盖的重新加载间隔（秒）：多 worker 时管理后台的修改只落在处理该请求的进程，其他进程按此间隔跟上
+STAGE_MODELS_REFRESH_SECONDS = float(os.getenv("PLANNER_STAGE_MODELS_REFRESH_SECONDS", "10"))
+
+
 class LLMPlanner:
     def __init__(self):
-        base_url = _ensure_v1_url(os.getenv("BASE_URL", "https://api.geekai.pro"))
+        self.base_url = _ensure_v1_url(os.getenv("BASE_URL", "https://api.geekai.pro"))
+        # 所有 OpenAI 客户端共享同一个 HTTP 连接池，按 key 区分的只是鉴权头
+        self._http_client = httpx.Client(
+            timeout=httpx.Timeout(600.0, connect=10.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            follow_redirects=True,
+        )
         self.client = OpenAI(
-            base_url=base_url,
+            base_url=self.base_url,
             api_key=os.getenv("API_KEY", ""),
+            http_client=self._http_client,
         )
+        self._clients = OrderedDict()  # (base_url, api_key) -> OpenAI
+        self._clients_lock = threading.Lock()
         self.logic_model = os.getenv("MODEL_LOGIC", "google/gemini-3-pro-preview")
+        self.fast_model = os.getenv("MODEL_FAST", "") or self.logic_model
+        self.stage_models = {}  # 运行时覆盖（来自 system_config.planner_stage_models）
+        self._stage_models_loader = None
+        self._stage_models_loaded_at = 0.0
+        self._stage_stats = {}
+        self._stats_lock = threading.Lock()
+
+    def set_stage_models(self, mapping: dict):
+        """设置按阶段的模型覆盖，如 {"keywords": "gemini-2.5-flash"}；未知阶段与空值会被忽略。"""
+        mapping = mapping or {}
+        self.stage_models = {
+            k: v.strip() for k, v in mapping.items()
+            if k in PLANNER_STAGES and isinstance(v, str) and v.strip()
+        }
 
-    def _get_client(self, api_key: str = None):
-        if api_key:
-            base_url = _ensure_v1_url(os.getenv("BASE_URL", "https://api.geekai.pro"))
-            return OpenAI(base_url=base_url, api_key=api_key)
-        return self.client
+    def set_stage_models_loader(self, loader):
+        """设置阶段模型覆盖的加载函数（返回 dict），立即加载一次，之后每 STAGE_MODELS_REFRESH_SECONDS 秒按需重新加载。"""
+        self._stage_models_loader = loader
+        self._stage_models_loaded_at = 0.0
+        self._refresh_stage_models()
+
+    def _refresh_stage_models(self):
+        loader = self._stage_models_loader
+        if loader is None or time.monotonic() - self._stage_models_loaded_at < STAGE_MODELS_REFRESH_SECONDS:
+            return
+        self._stage_models_loaded_at = time.monotonic()
+        try:
+            self.set_stage_models(loader())
+        except Exception as e:
+            print(f"Load planner stage models failed: {e}")
+
+    def model_for_stage(self, stage: str) -> str:
+        """阶段模型解析顺序：system_config 覆盖 > MODEL_STAGE_<STAGE> 环境变量 > 轻量阶段用 MODEL_FAST > MODEL_LOGIC。"""
+        self._refresh_stage_models()
+        if stage in self.stage_models:
+            return self.stage_models[stage]
+        env_model = os.getenv(f"MODEL_STAGE_{stage.upper()}", "")
+        if env_model:
+            return env_model
+        if stage in LIGHT_STAGES:
+            return self.fast_model
+        return self.logic_model
+
+    def _record_latency(self, stage: str, model: str, elapsed: float, ok: bool):
+        with self._stats_lock:
+            st = self._stage_stats.setdefault(stage, {
+                "model": model, "calls": 0, "errors": 0, "total_ms": 0.0, "last_ms": 0.0, "max_ms": 0.0,
+            })
+            ms = elapsed * 1000
+            st["model"] = model
+            st["calls"] += 1
+            st["errors"] += 0 if ok else 1
+            st["total_ms"] += ms
+            st["last_ms"] = ms
+            st["max_ms"] = max(st["max_ms"], ms)
+
+    def get_stage_stats(self) -> dict:
+        """各阶段调用次数与耗时（毫秒），用于确认分级路由后的提速效果。"""
+        with self._stats_lock:
+            result = {}
+            for stage, st in self._stage_stats.items():
+                result[stage] = {
+                    "model": st["model"],
+                    "calls": st["calls"],
+                    "errors": st["errors"],
+                    "avg_ms": round(st["total_ms"] / st["calls"], 1) if st["calls"] else 0,
+                    "last_ms": round(st["last_ms"], 1),
+                    "max_ms": round(st["max_ms"], 1),
+                }
+            return result
 
-    def _call_llm(self, client, system_prompt: str, user_message: str, json_mode: bool = False):
-        """统一的 LLM 调用方法"""
+    def _get_client(self, api_key: str = None):
+        """按 (base_url, api_key) 复用客户端；池满时淘汰最久未用的，连接池共享故淘汰无需关闭。"""
+        if not api_key:
+            return self.client
+        key = (self.base_url, api_key)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+            client = OpenAI(base_url=self.base_url, api_key=api_key, http_client=self._http_client)
+            self._clients[key] = client
+            while len(self._clients) > max(1, CLIENT_POOL_SIZE):
+                self._clients.popitem(last=False)
+            return client
+
+    def _call_llm(self, client, system_prompt: str, user_message: str, json_mode: bool = False, stage: str = "integrate"):
+        """统一的 LLM 调用方法：按 stage 选择模型并记录耗时"""
+        model = self.model_for_stage(stage)
+        start = time.perf_counter()
+        ok = False
+        try:
+            content = self._create_completion(client, model, system_prompt, user_message, json_mode)
+            ok = True
+            return content
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record_latency(stage, model, elapsed, ok)
+            print(f"[Planner] stage={stage} model={model} {elapsed * 1000:.0f}ms{'' if ok else ' (error)'}")
+
+    def _create_completion(self, client, model: str, system_prompt: str, user_message: str, json_mode: bool = False):
         kwargs = {
-            "model": self.logic_model,
+            "model": model,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message},
@@ -346,7 +467,7 @@ class LLMPlanner:
             "Each line one item. No explanation."
         )
         user_msg = f"主题：{topic}\n{lang_instruction}"
-        result = self._call_llm(client, system_prompt, user_msg)
+        result = self._call_llm(client, system_prompt, user_msg, stage="keywords")
         if not result:
             return ""
         # 规范化为最多 5 行，去空
@@ -407,7 +528,7 @@ class LLMPlanner:
 以下是用户确认后的幻灯片大纲（可能缺少 narrative_bridge/visual_subject）：
 {json.dumps(slides, ensure_ascii=False)}
 """
-        content = self._call_llm(client, system_prompt, user_msg, json_mode=True)
+        content = self._call_llm(client, system_prompt, user_msg, json_mode=True, stage="enrich")
         if not content:
             return {"error": "Empty response from outline refiner"}
         try:
@@ -429,7 +550,7 @@ class LLMPlanner:
 目标: {purpose}
 """
         try:
-            content = self._call_llm(client, STYLE_AGENT_PROMPT, user_msg, json_mode=True)
+            content = self._call_llm(client, STYLE_AGENT_PROMPT, user_msg, json_mode=True, stage="style")
             if not content:
                 return {
                     "global_style_prompt": "Clean modern presentation style, balanced color palette, soft lighting, minimal noise, professional layout.",
@@ -455,7 +576,7 @@ class LLMPlanner:
         lang_label, _ = self._get_language_labels(language)
         lang_instruction = "请用中文输出。" if language == "zh" else f"Please output in {lang_label}."
         user_msg = f"主题：{topic}\n{lang_instruction}\n\n以下是用户提供的原始材料，请提炼为适合 PPT 演示的内容：\n\n{context_text}"
-        result = self._call_llm(client, CONTENT_AGENT_PROMPT, user_msg)
+        result = self._call_llm(client, CONTENT_AGENT_PROMPT, user_msg, stage="content")
         return result or context_text
 
     def _generate_hook_titles(self, client, topic: str, refined_content: str = "", language: str = "zh", ask_map_context: str = "", keyword_context: str = "") -> str:
@@ -469,7 +590,7 @@ class LLMPlanner:
             user_msg += f"\n\n{ask_map_context}"
         if keyword_context:
             user_msg += f"\n\n{keyword_context}"
-        result = self._call_llm(client, HOOK_AGENT_PROMPT, user_msg)
+        result = self._call_llm(client, HOOK_AGENT_PROMPT, user_msg, stage="hook")
         return result or topic
 
     def _generate_structure(self, client, topic: str, refined_content: str = "", language: str = "zh", ask_map_context: str = "", keyword_context: str = "") -> str:
@@ -483,7 +604,7 @@ class LLMPlanner:
             user_msg += f"\n\n{ask_map_context}"
         if keyword_context:
             user_msg += f"\n\n{keyword_context}"
-        result = self._call_llm(client, STRUCTURE_AGENT_PROMPT, user_msg)
+        result = self._call_llm(client, STRUCTURE_AGENT_PROMPT, user_msg, stage="structure")
         return result or ""
 
     def generate_ppt_outline(self, topic: str, page_count: int = 5, context_text: str = "", language: str = "zh", api_key: str = None, audience: str = "", scene: str = "", attention: str = "", purpose: str = "", presentation_mode: str = "slides", style_preset_id: str = None, progress_cb=None):
@@ -555,6 +676,21 @@ class LLMPlanner:
                 refined_content, page_count, language, ask_map_context, keyword_context,
                 global_style_prompt, style_meta, presentation_mode
             )
+            if "error" in result:
+                return result
+
+            # === 阶段 5: 页数修复（仅在页数不符时触发，只增补/合并差额页）===
+            slides_list = result.get("slides", [])
+            if len(slides_list) != page_count:
+                print(f"[Planner] Slide count mismatch: expected {page_count}, got {len(slides_list)}, repairing...")
+                if progress_cb:
+                    progress_cb("repair", "正在校正页数", 90)
+                repaired = self._repair_slide_count(
+                    client, topic, slides_list, page_count, language, presentation_mode
+                )
+                if repaired is None:
+                    return {"error": f"Slide count mismatch: expected {page_count} slides, got {len(slides_list)}"}
+                result["slides"] = repaired
             if progress_cb:
                 progress_cb("done", "规划完成", 100)
             return result
@@ -641,19 +777,124 @@ You are now the Final Integration Agent. Combine the outputs from Hook Agent, St
         if keyword_context:
             user_msg += f"\n\n{keyword_context}"
 
-        content = self._call_llm(client, system_prompt, user_msg, json_mode=True)
+        content = self._call_llm(client, system_prompt, user_msg, json_mode=True, stage="integrate")
         if not content:
             return {"error": "Empty response from integration agent"}
         result = json.loads(content)
-        slides_list = result.get("slides", [])
-        if len(slides_list) != page_count:
-            print(f"[Planner] Slide count mismatch: expected {page_count}, got {len(slides_list)}")
-            return {"error": f"Slide count mismatch: expected {page_count} slides, got {len(slides_list)}"}
+        if not isinstance(result.get("slides"), list):
+            result["slides"] = []
         result["global_style_prompt"] = global_style_prompt
         result["style_meta"] = style_meta
         result["presentation_mode"] = presentation_mode
         return result
 
+    def _repair_slide_count(self, client, topic: str, slides: list, page_count: int, language: str = "zh", presentation_mode: str = "slides"):
+        """
+        页数修复：整合结果页数与 page_count 不符时，只让 LLM 给出补充/合并操作，
+        其余页原样保留。修复成功返回新的 slides 列表，失败返回 None。
+        """
+        diff = page_count - len(slides)
+        if diff == 0:
+            return slides
+        if page_count <= 0 or not slides:
+            return None
+        lang_label, _ = self._get_language_labels(language)
+        mode_label = "演示用幻灯片" if presentation_mode == "slides" else "详细演示文稿"
+        if diff > 0:
+            task = (
+                f"The outline is missing {diff} slide(s). Output exactly {diff} \"insert\" operation(s). "
+                "Each inserted slide must fill a real gap in the storyline. "
+                "Never insert before index 0 (the cover) and keep the closing slide last."
+            )
+            op_format = '{"action": "insert", "after_index": 3, "slide": {"title": "...", "content_summary": "...", "narrative_bridge": "...", "visual_subject": "..."}}'
+        else:
+            task = (
+                f"The outline has {-diff} extra slide(s). Output \"merge\" operations that merge adjacent slides "
+                f"so that the total drops by exactly {-diff}. Each merge replaces the listed consecutive indices with ONE slide. "
+                "Never merge the cover (index 0)."
+            )
+            op_format = '{"action": "merge", "indices": [4, 5], "slide": {"title": "...", "content_summary": "...", "narrative_bridge": "...", "visual_subject": "..."}}'
+
+        system_prompt = f"""You are a PPT outline repair agent.
+Do NOT rewrite the outline. Only add or merge the minimum number of slides; all other slides stay exactly as they are.
+
+# TASK
+{task}
+
+# LANGUAGE RULES
+- title/content_summary/narrative_bridge MUST be in {lang_label}.
+- visual_subject MUST be in English.
+
+# OUTPUT JSON (strict)
+{{
+  "operations": [
+    {op_format}
+  ]
+}}"""
+
+        compact = [
+            {"index": i, "title": s.get("title", ""), "content_summary": s.get("content_summary", "")}
+            for i, s in enumerate(slides)
+        ]
+        user_msg = f"""主题: {topic}
+模式: {mode_label}
+目标页数: {page_count}
+当前页数: {len(slides)}
+
+当前大纲（index 从 0 开始）：
+{json.dumps(compact, ensure_ascii=False)}
+"""
+        try:
+            content = self._call_llm(client, system_prompt, user_msg, json_mode=True, stage="repair")
+            if not content:
+                return None
+            operations = json.loads(content).get("operations") or []
+            repaired = self._apply_repair_operations(slides, operations, diff)
+        except Exception as e:
+            print(f"[Planner] Slide count repair failed: {e}")
+            return None
+        if repaired is None or len(repaired) != page_count:
+            print(f"[Planner] Slide count repair rejected: expected {page_count}, got {len(repaired) if repaired else 0}")
+            return None
+        for i, s in enumerate(repaired):
+            s["index"] = i
+        return repaired
+
+    def _apply_repair_operations(self, slides: list, operations: list, diff: int):
+        """
+        应用修复操作：insert 在 after_index 之后插入；merge 用一页替换相邻的若干页。非法操作返回 None。
+        封面之前与收尾页之后不允许插入（只有一页时可插在其后）。
+        """
+        slots = [[s] for s in slides]  # 每个原始页一个槽位，insert 追加到槽位尾部，merge 清空被合并的槽位
+        last_insert = len(slots) - 2 if len(slots) > 1 else 0
+        for op in operations:
+            if not isinstance(op, dict) or not isinstance(op.get("slide"), dict):
+                return None
+            action = op.get("action")
+            if action == "insert" and diff > 0:
+                after = op.get("after_index")
+                if not isinstance(after, int) or after < 0 or after > last_insert:
+                    return None
+                slots[after].append(op["slide"])
+            elif action == "merge" and diff < 0:
+                indices = op.get("indices") or []
+                if (
+                    len(indices) < 2
+                    or not all(isinstance(i, int) for i in indices)
+                    or sorted(indices) != list(range(min(indices), max(indices) + 1))
+                    or min(indices) <= 0
+                    or max(indices) >= len(slots)
+                    or any(len(slots[i]) != 1 or slots[i][0] is not slides[i] for i in indices)
+                ):
+                    return None
+                first = min(indices)
+                for i in indices:
+                    slots[i] = []
+                slots[first] = [op["slide"]]
+            else:
+                return None
+        return [s for slot in slots for s in slot]
+
     def plan_insertion_prompts(self, user_requirement: str, previous_context: str = "", api_key: str = None):
         """插入模式的微型规划。"""
         client = self._get_client(api_key)
@@ -673,7 +914,7 @@ Output strictly in JSON:
         user_msg = f"Request: {user_requirement}\nPrevious Slide Context: {previous_context}"
 
         try:
-            content = self._call_llm(client, system_prompt, user_msg, json_mode=True)
+            content = self._call_llm(client, system_prompt, user_msg, json_mode=True, stage="insertion")
             if not content:
                 return [f"A clean modern presentation slide. {user_requirement}"]
             data = json.loads(content)
@@ -690,6 +931,7 @@ Output strictly in JSON:
                 client,
                 "Summarize user input into a concise title (max 6 words). Output raw text only, no quotes.",
                 user_input,
+                stage="short_title",
             )
             return content or "New Project"
         except:
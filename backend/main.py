@@ -2,44 +2,34 @@ import os
 import base64
 import uvicorn
 from typing import Optional, List
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 import asyncio
 import json
 import threading
-import time
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 
+# 先加载 .env：下面的模块在导入时读取部分配置（状态存储、队列、SQLite 参数等）
+load_dotenv()
+
 from file_handler import FileHandler
-from llm_planner import LLMPlanner
+from llm_planner import LLMPlanner, PLANNER_STAGES
 from image_gen import ImageGenerator
 from database import (
     get_db,
-    init_db,
     SessionLocal,
-    migrate_add_deleted_at,
-    migrate_add_slide_deleted_at,
-    migrate_add_generation_fields,
-    migrate_add_params,
-    migrate_add_topic,
-    migrate_add_user_id,
-    migrate_points_to_scores,
-    migrate_add_is_published,
-    migrate_create_score_logs,
-    migrate_add_score_logs_balance,
-    migrate_add_score_logs_type,
-    seed_default_admin,
-    seed_system_config,
-    seed_default_user,
+    run_migrations,
 )
 from repository import (
     list_presentations,
     create_presentation,
     get_presentation,
+    PRESENTATION_VIEWS,
     update_presentation,
     delete_presentation,
     restore_presentation,
@@ -49,8 +39,6 @@ from repository import (
     set_presentation_published,
     list_published_presentations,
     get_presentation_public,
-    add_slide_version,
-    update_generation_progress,
     get_generation_progress,
     add_slide_version_by_slide_id,
     insert_slide_at_index,
@@ -63,6 +51,10 @@ from repository import (
     get_slide_context_messages,
     get_slide_by_id,
     get_slide_by_position,
+    get_slide_index,
+    move_slide,
+    apply_slide_operations,
+    SLIDE_OPERATIONS,
     _slide_to_dict,
     _version_to_dict,
     get_user_by_username,
@@ -72,8 +64,18 @@ from repository import (
     get_user_scores,
     deduct_scores,
     add_scores,
+    reserve_scores,
+    release_reserved_scores,
+    replace_outline_items,
+    list_outline_items,
     get_scores_per_slide,
     get_register_bonus_scores,
+    get_planner_stage_models,
+    save_plan_result,
+    save_plan_error,
+    clear_plan_result,
+    get_plan_result,
+    count_generation_jobs,
     record_score_log,
     get_config,
     set_config,
@@ -93,17 +95,23 @@ from repository import (
     list_score_logs_by_user,
     list_score_logs_admin,
 )
-from utils import save_image_locally, save_image_locally_sync
+from utils import save_image_locally
+from generation import GENERATION_TERMINAL_EVENTS, set_generation_progress
+from job_queue import create_generation_queue, start_credit_hold_sweeper
+from single_flight import SingleFlight, make_flight_key
+from state_store import create_state_store
+from gallery_cache import GalleryCache, install_invalidation
+from progress_bus import ProgressBus, format_sse
 from auth import (
     create_access_token,
     get_current_user,
+    get_owned_presentation,
+    get_owned_presentation_for_stream,
     get_current_admin,
     verify_password,
     hash_password,
 )
 
-load_dotenv()
-
 app = FastAPI(title="AI PPT Agent Backend", version="2.0.0")
 
 app.add_middleware(
@@ -134,30 +142,39 @@ app.mount("/images", StaticFiles(directory="storage/images"), name="images")
 planner = LLMPlanner()
 image_gen = ImageGenerator()
 
-PLAN_PROGRESS = {}
-PLAN_RESULTS = {}
+# 规划进度放在可共享的状态存储中（STATE_STORE_URL），带 TTL 与容量上限，多 worker 时互相可见；
+# 规划结果随演示文稿落库（plan_result），见 GET /presentations/{id}/plan
+state_store = create_state_store()
+PLAN_PROGRESS = state_store.map("plan_progress")
+# 作品广场缓存：条目默认在本进程内存（GALLERY_CACHE_URL 可改为共享存储），失效代号放在共享状态存储
+gallery_cache = GalleryCache(create_state_store(os.getenv("GALLERY_CACHE_URL") or "memory://"), state_store)
+install_invalidation(gallery_cache)
+_plan_progress_lock = threading.Lock()
+request_flights = SingleFlight()
+progress_bus = ProgressBus(store=state_store)
+# 批量生成任务队列（GENERATION_QUEUE=local 在本进程执行，=db 交给独立 worker.py）
+generation_queue = create_generation_queue(image_gen, progress_bus)
+
+
+@app.on_event("startup")
+async def bind_progress_bus():
+    progress_bus.bind_loop(asyncio.get_running_loop())
 
 
 @app.on_event("startup")
 def startup():
-    init_db()
+    run_migrations()
+    start_credit_hold_sweeper()
+    planner.set_stage_models_loader(_load_planner_stage_models)
+
+
+def _load_planner_stage_models() -> dict:
+    """从 system_config 读取阶段模型覆盖；各 worker 进程定时调用，管理后台的修改无需重启即可在所有进程生效。"""
+    db = SessionLocal()
     try:
-        migrate_add_deleted_at()
-        migrate_add_slide_deleted_at()
-        migrate_add_generation_fields()
-        migrate_add_params()
-        migrate_add_topic()
-        migrate_add_user_id()
-        migrate_points_to_scores()
-        migrate_add_is_published()
-        migrate_create_score_logs()
-        migrate_add_score_logs_balance()
-        migrate_add_score_logs_type()
-        seed_default_admin()
-        seed_system_config()
-        seed_default_user()
-    except Exception:
-        pass
+        return get_planner_stage_models(db)
+    finally:
+        db.close()
 
 
 # --- Pydantic models ---
@@ -226,6 +243,21 @@ class InsertSlideByOutlineRequest(BaseModel):
     language: Optional[str] = "zh"
 
 
+class MoveSlideRequest(BaseModel):
+    index: int  # 目标位置：未删除幻灯片中的序号（从 0 开始）
+
+
+class SlideOperation(BaseModel):
+    op: str  # move | delete | restore | activate
+    slide_id: str
+    index: Optional[int] = None  # move：目标位置（未删除幻灯片中的序号）
+    version_id: Optional[str] = None  # activate：要切换到的版本
+
+
+class SlideBatchRequest(BaseModel):
+    operations: List[SlideOperation] = Field(..., min_length=1, max_length=500)
+
+
 class CreateVersionRequest(BaseModel):
     prompt: str
     is_modification: bool = False
@@ -269,6 +301,7 @@ class AdminInviteCodesRequest(BaseModel):
 class AdminConfigUpdateRequest(BaseModel):
     scores_per_slide: Optional[int] = None
     register_bonus_scores: Optional[int] = None
+    planner_stage_models: Optional[dict] = None  # {"keywords": "model", ...}，空字符串表示使用默认
 
 
 # --- Helpers ---
@@ -454,51 +487,42 @@ def api_clear_recycle_bin(db: Session = Depends(get_db), current_user = Depends(
 
 
 @app.get("/presentations/{presentation_id}")
-def api_get_presentation(presentation_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    data = get_presentation(db, presentation_id, user_id=current_user.id)
+def api_get_presentation(presentation_id: str, view: str = "full", db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    """view=summary 每张幻灯片只带当前版本（编辑器首屏），view=full 带完整版本历史。"""
+    if view not in PRESENTATION_VIEWS:
+        raise HTTPException(400, f"view must be one of: {', '.join(PRESENTATION_VIEWS)}")
+    data = get_presentation(db, presentation_id, user_id=current_user.id, view=view)
     if not data:
         raise HTTPException(404, "Presentation not found")
     return data
 
 
-@app.patch("/presentations/{presentation_id}")
-def api_update_presentation(presentation_id: str, req: UpdatePresentationRequest, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    data = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not data:
-        raise HTTPException(404, "Presentation not found")
+@app.patch("/presentations/{presentation_id}", dependencies=[Depends(get_owned_presentation)])
+def api_update_presentation(presentation_id: str, req: UpdatePresentationRequest, db: Session = Depends(get_db)):
     ok = update_presentation(db, presentation_id, title=req.title, global_style=req.global_style)
     if not ok:
         raise HTTPException(404, "Presentation not found")
     return {"status": "success"}
 
 
-@app.delete("/presentations/{presentation_id}")
-def api_delete_presentation(presentation_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    data = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not data:
-        raise HTTPException(404, "Presentation not found")
+@app.delete("/presentations/{presentation_id}", dependencies=[Depends(get_owned_presentation)])
+def api_delete_presentation(presentation_id: str, db: Session = Depends(get_db)):
     ok = delete_presentation(db, presentation_id)
     if not ok:
         raise HTTPException(404, "Presentation not found")
     return {"status": "success"}
 
 
-@app.post("/presentations/{presentation_id}/restore")
-def api_restore_presentation(presentation_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    data = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not data:
-        raise HTTPException(404, "Presentation not found")
+@app.post("/presentations/{presentation_id}/restore", dependencies=[Depends(get_owned_presentation)])
+def api_restore_presentation(presentation_id: str, db: Session = Depends(get_db)):
     ok = restore_presentation(db, presentation_id)
     if not ok:
         raise HTTPException(404, "Presentation not found")
     return {"status": "success"}
 
 
-@app.delete("/presentations/{presentation_id}/permanent")
-def api_permanently_delete_presentation(presentation_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    data = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not data:
-        raise HTTPException(404, "Presentation not found")
+@app.delete("/presentations/{presentation_id}/permanent", dependencies=[Depends(get_owned_presentation)])
+def api_permanently_delete_presentation(presentation_id: str, db: Session = Depends(get_db)):
     ok = permanently_delete_presentation(db, presentation_id)
     if not ok:
         raise HTTPException(404, "Presentation not found or not in recycle bin")
@@ -506,18 +530,9 @@ def api_permanently_delete_presentation(presentation_id: str, db: Session = Depe
 
 
 @app.post("/presentations/{presentation_id}/publish")
-def api_publish_presentation(presentation_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+def api_publish_presentation(presentation_id: str, db: Session = Depends(get_db), pres: dict = Depends(get_owned_presentation)):
     """发布或取消发布演示文稿。"""
-    # 先检查演示文稿是否存在且属于当前用户
-    data = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not data:
-        raise HTTPException(404, "Presentation not found")
-    # 获取当前发布状态
-    from models import Presentation
-    p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
-    if not p:
-        raise HTTPException(404, "Presentation not found")
-    current_status = getattr(p, "is_published", None) or 0
+    current_status = pres.get("is_published") or 0
     new_status = 1 if current_status == 0 else 0
     ok = set_presentation_published(db, presentation_id, new_status == 1)
     if not ok:
@@ -527,74 +542,178 @@ def api_publish_presentation(presentation_id: str, db: Session = Depends(get_db)
 
 # === Gallery (Public) ===
 
+def _cached_json(request: Request, entry: dict):
+    """返回带 ETag 的缓存响应；If-None-Match 命中时返回 304。"""
+    headers = {
+        "ETag": entry["etag"],
+        "Cache-Control": f"public, max-age=0, stale-while-revalidate={gallery_cache.stale}",
+    }
+    if request.headers.get("if-none-match") == entry["etag"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=entry["body"], headers=headers)
+
+
 @app.get("/gallery")
-def api_list_gallery(skip: int = 0, limit: int = 20, db: Session = Depends(get_db)):
-    """获取作品广场列表（公开，无需认证）。"""
-    presentations = list_published_presentations(db, skip=skip, limit=limit)
-    return {"presentations": presentations}
+def api_list_gallery(request: Request, skip: int = 0, limit: int = 20, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """获取作品广场列表（公开，无需认证）。传入上一页返回的 next_cursor 翻页；skip 仅为兼容旧客户端保留。"""
+    limit = max(1, min(limit, 100))
+
+    def load(session: Session) -> dict:
+        presentations, next_cursor = list_published_presentations(session, skip=skip, limit=limit, cursor=cursor)
+        return {"presentations": presentations, "next_cursor": next_cursor}
+
+    try:
+        entry = gallery_cache.get_list(db, cursor, skip, limit, load)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    return _cached_json(request, entry)
 
 
 @app.get("/gallery/{presentation_id}")
-def api_get_gallery_presentation(presentation_id: str, db: Session = Depends(get_db)):
+def api_get_gallery_presentation(presentation_id: str, request: Request, db: Session = Depends(get_db)):
     """获取作品广场中的演示文稿详情（公开，无需认证）。"""
-    data = get_presentation_public(db, presentation_id)
-    if not data:
+    entry = gallery_cache.get_detail(db, presentation_id, lambda session: get_presentation_public(session, presentation_id))
+    if not entry:
         raise HTTPException(404, "Presentation not found or not published")
-    return data
+    return _cached_json(request, entry)
 
 
 # === Plan & Batch Generate ===
 
 @app.post("/presentations/{presentation_id}/plan")
-async def api_plan(presentation_id: str, req: PlanRequest, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    pres = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not pres:
-        raise HTTPException(404, "Presentation not found")
-    auto_title = None
+async def api_plan(
+    presentation_id: str,
+    req: PlanRequest,
+    detach: bool = False,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user),
+    pres: dict = Depends(get_owned_presentation),
+):
+    """规划大纲。detach=true 时立即返回 202，规划在后台继续，完成后通过 GET /plan 取回结果。"""
+    # 相同演示文稿 + 相同输入的并发请求合并为一次规划
+    key = make_flight_key("plan", presentation_id, {"user_id": current_user.id, **req.dict()})
+    if detach:
+        request_flights.start(key, lambda: _run_plan(presentation_id, req))
+        return JSONResponse(status_code=202, content={"status": "accepted"})
+    plan, _ = await request_flights.do(key, lambda: _run_plan(presentation_id, req))
+    return plan
+
+
+@app.get("/presentations/{presentation_id}/plan", dependencies=[Depends(get_owned_presentation)])
+def api_get_plan(presentation_id: str, db: Session = Depends(get_db)):
+    """
+    获取规划状态与结果，供断线重连或 detach 模式的客户端取回大纲。
+    status：running（进行中，附 progress）/ done（附 plan）/ failed（附 error）/ idle（尚未规划）。
+    """
+    progress = PLAN_PROGRESS.get(presentation_id)
+    if progress and progress.get("stage") not in ("done", "failed"):
+        return {"status": "running", "progress": progress, "plan": None, "error": None}
+    stored = get_plan_result(db, presentation_id) or {}
+    if stored.get("plan") is not None:
+        status = "done"
+    elif stored.get("error"):
+        status = "failed"
+    else:
+        status = "idle"
+    return {
+        "status": status,
+        "progress": progress,
+        "plan": stored.get("plan"),
+        "error": stored.get("error"),
+        "planned_at": stored.get("planned_at"),
+    }
+
+
+async def _run_plan(presentation_id: str, req: PlanRequest) -> dict:
+    """执行一次完整规划并落库。独立会话：合并后的任务可能比发起请求活得更久。"""
+    db = SessionLocal()
+    try:
+        return await _plan_presentation(db, presentation_id, req)
+    finally:
+        db.close()
+
+
+def _set_plan_progress(presentation_id: str, stage: str, label: str, progress: int) -> None:
+    """更新规划进度；保留已生成的自动标题，便于进度监听方随时拿到。"""
+    payload = {
+        "stage": stage,
+        "label": label,
+        "progress": progress,
+    }
+    with _plan_progress_lock:
+        title = PLAN_PROGRESS.get(presentation_id, {}).get("title")
+        if title:
+            payload["title"] = title
+        PLAN_PROGRESS[presentation_id] = payload
+    progress_bus.publish(f"plan:{presentation_id}", "progress", payload)
+
+
+async def _generate_auto_title(db: Session, presentation_id: str, topic: str) -> Optional[str]:
+    """与大纲规划并行生成短标题，生成后立即写入演示文稿并推送给进度监听方。"""
+    if not hasattr(planner, "generate_short_title"):
+        return None
     try:
-        if hasattr(planner, "generate_short_title"):
-            auto_title = planner.generate_short_title(req.topic)
-            update_presentation(db, presentation_id, title=auto_title)
+        auto_title = await asyncio.to_thread(planner.generate_short_title, topic)
+        update_presentation(db, presentation_id, title=auto_title)
     except Exception as e:
         print(f"Auto-title failed: {e}")
-    PLAN_PROGRESS[presentation_id] = {
-        "stage": "parse_params",
-        "label": "正在解析参数",
-        "progress": 10,
-    }
+        return None
+    with _plan_progress_lock:
+        progress = dict(PLAN_PROGRESS.get(presentation_id) or {"stage": "parse_params", "label": "正在解析参数", "progress": 10})
+        progress["title"] = auto_title
+        PLAN_PROGRESS[presentation_id] = progress
+    progress_bus.publish(f"plan:{presentation_id}", "progress", progress)
+    return auto_title
+
+
+async def _plan_presentation(db: Session, presentation_id: str, req: PlanRequest) -> dict:
+    """
+    执行规划并落库。新一轮开始时清除上次的规划结果；大纲条目与规划结果落库后才推送 done，
+    收到 done 的调用方随即 GET /plan 一定取到本轮结果。任何一步失败都经 _fail_plan 记录错误并推送 failed。
+    """
+    PLAN_PROGRESS.pop(presentation_id, None)
+    _set_plan_progress(presentation_id, "parse_params", "正在解析参数", 10)
+    try:
+        return await _plan_and_save(db, presentation_id, req)
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else (str(e) or type(e).__name__)
+        print(f"Plan for {presentation_id} failed: {error}")
+        db.rollback()
+        _fail_plan(db, presentation_id, error)
+
+
+async def _plan_and_save(db: Session, presentation_id: str, req: PlanRequest) -> dict:
+    clear_plan_result(db, presentation_id)
+    # 标题不依赖大纲：与规划流水线同时启动，不占用关键路径
+    title_task = asyncio.create_task(_generate_auto_title(db, presentation_id, req.topic))
     def _progress_cb(stage, label, progress):
-        PLAN_PROGRESS[presentation_id] = {
-            "stage": stage,
-            "label": label,
-            "progress": progress,
-        }
-    plan = await asyncio.to_thread(
-        planner.generate_ppt_outline,
-        topic=req.topic,
-        page_count=req.page_count,
-        context_text=req.context_text or "",
-        language=req.language or "zh",
-        audience=req.audience or "",
-        scene=req.scene or "",
-        attention=req.attention or "",
-        purpose=req.purpose or "",
-        presentation_mode=req.presentation_mode or "slides",
-        style_preset_id=req.style_preset_id,
-        progress_cb=_progress_cb,
-    )
+        # 规划器的 done 只表示大纲已生成，落库完成后才推送真正的 done
+        if stage == "done":
+            stage, label, progress = "saving", "正在保存大纲", 95
+        _set_plan_progress(presentation_id, stage, label, progress)
+    try:
+        plan = await asyncio.to_thread(
+            planner.generate_ppt_outline,
+            topic=req.topic,
+            page_count=req.page_count,
+            context_text=req.context_text or "",
+            language=req.language or "zh",
+            audience=req.audience or "",
+            scene=req.scene or "",
+            attention=req.attention or "",
+            purpose=req.purpose or "",
+            presentation_mode=req.presentation_mode or "slides",
+            style_preset_id=req.style_preset_id,
+            progress_cb=_progress_cb,
+        )
+    finally:
+        auto_title = await title_task
     if "error" in plan:
-        PLAN_PROGRESS[presentation_id] = {
-            "stage": "failed",
-            "label": "规划失败",
-            "progress": 100,
-        }
-        raise HTTPException(500, detail=plan["error"])
+        raise RuntimeError(plan["error"])
     slides_list = plan.get("slides", [])
     if len(slides_list) != req.page_count:
-        raise HTTPException(
-            500,
-            detail=f"Plan must return exactly {req.page_count} slides, got {len(slides_list)}",
-        )
+        # 规划器已尝试页数修复，仍不符时才判定失败
+        raise RuntimeError(f"Plan must return exactly {req.page_count} slides, got {len(slides_list)}")
     if plan.get("global_style_prompt"):
         update_presentation(db, presentation_id, global_style=plan["global_style_prompt"])
     params_json = json.dumps({
@@ -606,110 +725,45 @@ async def api_plan(presentation_id: str, req: PlanRequest, db: Session = Depends
         "attention": req.attention or "",
         "purpose": req.purpose or "",
         "page_count": req.page_count,
-        "outline": plan.get("slides", []),
     }, ensure_ascii=False)
     update_presentation(db, presentation_id, params=params_json)
+    replace_outline_items(db, presentation_id, slides_list)
     if auto_title:
         plan["session_title"] = auto_title
-    PLAN_RESULTS[presentation_id] = plan
-    PLAN_PROGRESS[presentation_id] = {
-        "stage": "done",
-        "label": "规划完成",
-        "progress": 100,
-    }
+    save_plan_result(db, presentation_id, plan)
+    _set_plan_progress(presentation_id, "done", "规划完成", 100)
     return plan
 
 
-def _run_generation_task(presentation_id: str, slides: list, user_id: Optional[str] = None):
-    """后台任务：按序生成每张幻灯片，并更新进度。每成功生成一张扣减 user 积分（若已登录）。"""
-    db = SessionLocal()
-    scores_per_slide = get_scores_per_slide(db) if user_id else 0
+def _fail_plan(db: Session, presentation_id: str, error: str) -> None:
+    """记录规划失败并推送 failed 进度，随后以 500 结束请求；错误落库失败时仍推送 failed。"""
     try:
-        if slides:
-            try:
-                params_json = json.dumps({"outline": slides}, ensure_ascii=False)
-                update_presentation(db, presentation_id, params=params_json)
-            except Exception:
-                pass
-        total = len([
-            s for s in slides
-            if (s.get("visual_prompt") or s.get("prompt") or s.get("visual_subject") or s.get("global_style_prompt") or "")
-        ])
-        if total == 0:
-            update_generation_progress(db, presentation_id, "completed", 0, 0)
-            return
-        prev_prompt = None
-        completed = 0
-        for i, item in enumerate(slides):
-            if item.get("_generated"):
-                continue
-            prompt = item.get("visual_prompt") or item.get("prompt") or ""
-            has_plan_fields = bool(item.get("visual_subject")) or bool(item.get("global_style_prompt"))
-            if not prompt and not has_plan_fields:
-                continue
-            try:
-                if has_plan_fields:
-                    image_url = image_gen.generate_slide_image_from_plan(
-                        slide_data=item,
-                        global_style_prompt=item.get("global_style_prompt", ""),
-                        presentation_mode=item.get("presentation_mode", "slides"),
-                    )
-                else:
-                    image_url = image_gen.generate_slide_image(
-                        prompt=prompt,
-                        reference_style_prompt=prev_prompt,
-                    )
-                if not image_url:
-                    continue
-                local_path = save_image_locally_sync(image_url, session_id=presentation_id)
-                if not local_path:
-                    continue
-                version_prompt = prompt
-                if has_plan_fields and not prompt:
-                    version_prompt = item.get("visual_subject", "") or "Generated from plan"
-                version_id = add_slide_version(
-                    db, presentation_id, i, image_path=local_path, prompt=version_prompt
-                )
-                if version_id:
-                    if user_id and scores_per_slide > 0:
-                        if deduct_scores(db, user_id, scores_per_slide):
-                            balance = get_user_scores(db, user_id)
-                            record_score_log(db, user_id, scores_per_slide, balance=balance, prompt=version_prompt, image_path=local_path)
-                    item["_generated"] = True
-                    completed += 1
-                    update_generation_progress(db, presentation_id, "generating", completed, total)
-                prev_prompt = prompt or item.get("visual_subject") or prev_prompt
-            except Exception as e:
-                update_generation_progress(
-                    db, presentation_id, "failed", completed, total, error=str(e)
-                )
-                return
-        if completed >= total:
-            update_generation_progress(db, presentation_id, "completed", completed, total)
-        else:
-            update_generation_progress(db, presentation_id, "failed", completed, total, error="Generation interrupted")
+        save_plan_error(db, presentation_id, error)
     except Exception as e:
-        try:
-            update_generation_progress(
-                db, presentation_id, "failed", 0, len(slides), error=str(e)
-            )
-        except Exception:
-            pass
-    finally:
-        db.close()
+        print(f"Save plan error for {presentation_id} failed: {e}")
+    _set_plan_progress(presentation_id, "failed", "规划失败", 100)
+    raise HTTPException(500, detail=error)
+
+
+def _set_generation_progress(
+    db: Session,
+    presentation_id: str,
+    status: str,
+    current: int = 0,
+    total: int = 0,
+    error: Optional[str] = None,
+) -> bool:
+    return set_generation_progress(progress_bus, db, presentation_id, status, current, total, error=error, write_through=True)
 
 
 @app.post("/presentations/{presentation_id}/generate")
 async def api_generate_batch(
     presentation_id: str,
     req: GenerateBatchRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user),
+    pres: dict = Depends(get_owned_presentation),
 ):
-    pres = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not pres:
-        raise HTTPException(404, "Presentation not found")
     slides = req.slides
     total = len([
         s for s in slides
@@ -717,30 +771,82 @@ async def api_generate_batch(
     ])
     if total == 0:
         return JSONResponse(status_code=202, content={"status": "accepted"})
-    scores_per = get_scores_per_slide(db)
-    need_scores = total * scores_per
-    if get_user_scores(db, current_user.id) < need_scores:
-        raise HTTPException(402, f"积分不足：需要 {need_scores} 积分，当前仅 {get_user_scores(db, current_user.id)}")
-    update_generation_progress(db, presentation_id, "generating", 0, total)
-    background_tasks.add_task(_run_generation_task, presentation_id, slides, current_user.id)
+    replace_outline_items(db, presentation_id, slides)
+    reservation_id = _reserve_generation_scores(db, current_user.id, presentation_id, total)
+    _start_generation(db, presentation_id, slides, current_user.id, reservation_id, 0, total)
     return JSONResponse(status_code=202, content={"status": "accepted"})
 
 
+def _reserve_generation_scores(db: Session, user_id: str, presentation_id: str, count: int) -> Optional[str]:
+    """受理批量生成时以一条条件 UPDATE 冻结 count 页的积分，余额不足返回 402；每页积分为 0 时不冻结。"""
+    need_scores = count * get_scores_per_slide(db)
+    if need_scores <= 0:
+        return None
+    reservation_id = reserve_scores(db, user_id, need_scores, presentation_id=presentation_id)
+    if reservation_id is None:
+        raise HTTPException(402, f"积分不足：需要 {need_scores} 积分，当前仅 {get_user_scores(db, user_id)}")
+    return reservation_id
+
+
+def _start_generation(
+    db: Session,
+    presentation_id: str,
+    slides: list,
+    user_id: str,
+    reservation_id: Optional[str],
+    current: int,
+    total: int,
+) -> None:
+    """
+    标记生成中并提交生成任务，须紧跟在冻结积分之后调用。
+    任何一步失败（包括请求被取消）都立即退回预留并把进度标为 failed，不留下冻结了积分却没有入队的任务；
+    退回本身失败时，遗留的预留由定时清扫（job_queue.start_credit_hold_sweeper）退回。
+    """
+    try:
+        _set_generation_progress(db, presentation_id, "generating", current, total)
+        generation_queue.enqueue(presentation_id, slides, user_id, reservation_id=reservation_id)
+    except BaseException:
+        try:
+            db.rollback()
+            if reservation_id:
+                release_reserved_scores(db, reservation_id)
+            _set_generation_progress(db, presentation_id, "failed", current, total, error="Failed to enqueue generation")
+        except Exception as e:
+            print(f"Roll back generation for {presentation_id} failed: {e}")
+        raise
+
+
 @app.post("/presentations/{presentation_id}/generate-from-outline")
 async def api_generate_from_outline(
     presentation_id: str,
     req: GenerateFromOutlineRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
     current_user = Depends(get_current_user),
+    pres: dict = Depends(get_owned_presentation),
 ):
-    pres = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not pres:
-        raise HTTPException(404, "Presentation not found")
+    # 相同演示文稿 + 相同大纲的并发请求合并：只补全、扣费校验与启动生成一次
+    key = make_flight_key("generate-from-outline", presentation_id, {"user_id": current_user.id, **req.dict()})
+    await request_flights.do(key, lambda: _run_enrich_outline(presentation_id, req, pres, current_user.id))
+    return JSONResponse(status_code=202, content={"status": "accepted"})
+
+
+async def _run_enrich_outline(presentation_id: str, req: GenerateFromOutlineRequest, pres: dict, user_id: str) -> int:
+    """
+    补全大纲、写入生成参数、冻结积分并提交生成任务，返回待生成的页数（0 表示无需生成）。
+    受理与入队都在这个合并任务内完成：发起请求断开时任务照常跑完，不会出现已标记生成中却没有入队的演示文稿。
+    """
+    db = SessionLocal()
+    try:
+        return await _enrich_outline_for_generation(db, presentation_id, req, pres, user_id)
+    finally:
+        db.close()
+
+
+async def _enrich_outline_for_generation(db: Session, presentation_id: str, req: GenerateFromOutlineRequest, pres: dict, user_id: str) -> int:
     topic = req.topic or pres.get("topic") or pres.get("title") or "Untitled PPT"
     presentation_mode = req.presentation_mode or "slides"
     language = req.language or "zh"
-    enriched = planner.enrich_outline(
+    enriched = await asyncio.to_thread(
+        planner.enrich_outline,
         topic=topic,
         slides=req.slides,
         language=language,
@@ -765,132 +871,193 @@ async def api_generate_from_outline(
         "style_preset_id": req.style_preset_id or "",
         "page_count": len(enriched_slides),
         "global_style_prompt": req.global_style_prompt,
-        "outline": slides_for_gen,
     }, ensure_ascii=False)
     update_presentation(db, presentation_id, params=params_json)
+    replace_outline_items(db, presentation_id, slides_for_gen)
     total = len([
         s for s in slides_for_gen
         if (s.get("visual_prompt") or s.get("prompt") or s.get("visual_subject") or s.get("global_style_prompt") or "")
     ])
     if total == 0:
-        return JSONResponse(status_code=202, content={"status": "accepted"})
-    scores_per = get_scores_per_slide(db)
-    need_scores = total * scores_per
-    if get_user_scores(db, current_user.id) < need_scores:
-        raise HTTPException(402, f"积分不足：需要 {need_scores} 积分，当前仅 {get_user_scores(db, current_user.id)}")
-    update_generation_progress(db, presentation_id, "generating", 0, total)
-    background_tasks.add_task(_run_generation_task, presentation_id, slides_for_gen, current_user.id)
-    return JSONResponse(status_code=202, content={"status": "accepted"})
+        return 0
+    reservation_id = _reserve_generation_scores(db, user_id, presentation_id, total)
+    _start_generation(db, presentation_id, slides_for_gen, user_id, reservation_id, 0, total)
+    return total
 
 
 @app.post("/presentations/{presentation_id}/resume-generate")
 async def api_resume_generate(
     presentation_id: str,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user),
+    pres: dict = Depends(get_owned_presentation),
 ):
-    pres = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not pres:
-        raise HTTPException(404, "Presentation not found")
-    params_raw = pres.get("params") or ""
-    try:
-        params = json.loads(params_raw) if params_raw else {}
-    except Exception:
-        params = {}
-    slides_for_gen = params.get("outline", [])
+    # 已生成的大纲条目带 _generated 标记，生成时跳过，只为未生成的页冻结积分
+    slides_for_gen = list_outline_items(db, presentation_id)
     if not slides_for_gen:
         raise HTTPException(400, "No outline to resume")
-    total = len([
+    generatable = [
         s for s in slides_for_gen
         if (s.get("visual_prompt") or s.get("prompt") or s.get("visual_subject") or s.get("global_style_prompt") or "")
-    ])
+    ]
+    total = len(generatable)
     if total == 0:
         return JSONResponse(status_code=202, content={"status": "accepted"})
-    current_done = pres.get("generation_current", 0) or 0
+    current_done = len([s for s in generatable if s.get("_generated")])
     remaining = total - current_done
+    reservation_id = None
     if remaining > 0:
-        scores_per = get_scores_per_slide(db)
-        need_scores = remaining * scores_per
-        if get_user_scores(db, current_user.id) < need_scores:
-            raise HTTPException(402, f"积分不足：需要 {need_scores} 积分，当前仅 {get_user_scores(db, current_user.id)}")
-    update_generation_progress(db, presentation_id, "generating", current_done, total)
-    background_tasks.add_task(_run_generation_task, presentation_id, slides_for_gen, current_user.id)
+        reservation_id = _reserve_generation_scores(db, current_user.id, presentation_id, remaining)
+    _start_generation(db, presentation_id, slides_for_gen, current_user.id, reservation_id, current_done, total)
     return JSONResponse(status_code=202, content={"status": "accepted"})
 
 
-@app.get("/presentations/{presentation_id}/generation-progress")
-def api_get_generation_progress(presentation_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    """获取演示文稿的生成进度，用于轮询。"""
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
+@app.get("/presentations/{presentation_id}/outline", dependencies=[Depends(get_owned_presentation)])
+def api_get_outline(presentation_id: str, db: Session = Depends(get_db)):
+    """大纲条目：每页的生成计划、生成状态（pending / generated）与生成出的幻灯片 id。"""
+    items = list_outline_items(db, presentation_id, with_status=True)
+    for item in items:
+        item.pop("_generated", None)
+    return {"items": items}
+
+
+@app.get("/presentations/{presentation_id}/generation-progress", dependencies=[Depends(get_owned_presentation)])
+def api_get_generation_progress(presentation_id: str, db: Session = Depends(get_db)):
+    """获取演示文稿的生成进度，用于轮询；优先返回进度总线上的最新进度（落库有合并延迟）。"""
+    latest = progress_bus.latest(f"generation:{presentation_id}")
+    if latest is not None and latest[0] in ("progress",) + GENERATION_TERMINAL_EVENTS:
+        return latest[1]
     progress = get_generation_progress(db, presentation_id)
     if not progress:
         raise HTTPException(404, "Presentation not found")
     return progress
 
 
-@app.get("/presentations/{presentation_id}/plan-progress")
-def api_plan_progress(presentation_id: str):
-    def event_stream():
-        last_payload = None
-        while True:
-            payload = PLAN_PROGRESS.get(presentation_id, {"stage": "idle", "label": "等待开始", "progress": 0})
-            data = json.dumps(payload, ensure_ascii=False)
-            if data != last_payload:
-                yield f"event: progress\ndata: {data}\n\n"
-                last_payload = data
-            if payload.get("stage") in ("done", "failed"):
-                yield "event: done\ndata: {}\n\n"
-                break
-            time.sleep(0.5)
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+@app.get("/presentations/{presentation_id}/plan-progress", dependencies=[Depends(get_owned_presentation_for_stream)])
+async def api_plan_progress(presentation_id: str):
+    """规划进度 SSE：订阅进度总线，事件驱动推送；带心跳与空闲超时，规划结束后关闭。"""
+    channel = f"plan:{presentation_id}"
+
+    async def event_stream():
+        if progress_bus.latest(channel) is None:
+            idle = PLAN_PROGRESS.get(presentation_id, {"stage": "idle", "label": "等待开始", "progress": 0})
+            yield format_sse("progress", idle)
+            if idle.get("stage") in ("done", "failed"):
+                yield format_sse("done", {})
+                return
+        async for event, payload in progress_bus.subscribe(channel, terminal_events=()):
+            if event == "timeout":
+                yield format_sse("timeout", {})
+                return
+            yield format_sse(event, payload)
+            if payload and payload.get("stage") in ("done", "failed"):
+                yield format_sse("done", {})
+                return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _read_generation_snapshot(presentation_id: str) -> dict:
+    """SSE 开始前读取一次生成进度：使用短会话并立即关闭，流式响应期间不占用连接池中的连接。"""
+    db = SessionLocal()
+    try:
+        return get_generation_progress(db, presentation_id) or {"status": "idle", "current": 0, "total": 0, "percentage": 0}
+    finally:
+        db.close()
+
+
+@app.get("/presentations/{presentation_id}/generation-stream", dependencies=[Depends(get_owned_presentation_for_stream)])
+async def api_generation_stream(presentation_id: str):
+    """生成进度 SSE：推送 progress / slide_done（含 version_id 与图片地址）/ completed / failed，替代轮询。"""
+    channel = f"generation:{presentation_id}"
+    snapshot = None
+    if progress_bus.latest(channel) is None:
+        snapshot = await run_in_threadpool(_read_generation_snapshot, presentation_id)
+
+    async def event_stream():
+        if snapshot is not None:
+            status = snapshot.get("status")
+            yield format_sse(status if status in GENERATION_TERMINAL_EVENTS else "progress", snapshot)
+            if status in GENERATION_TERMINAL_EVENTS:
+                return
+        async for event, payload in progress_bus.subscribe(channel, terminal_events=GENERATION_TERMINAL_EVENTS):
+            yield format_sse(event, payload)
+            if event == "timeout":
+                return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # === Slides ===
 
-@app.get("/presentations/{presentation_id}/slides/deleted")
-def api_list_deleted_slides(presentation_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
+@app.get("/presentations/{presentation_id}/slides/deleted", dependencies=[Depends(get_owned_presentation)])
+def api_list_deleted_slides(presentation_id: str, db: Session = Depends(get_db)):
     return {"slides": list_deleted_slides(db, presentation_id)}
 
 
-@app.post("/presentations/{presentation_id}/slides/{slide_id}/restore")
-def api_restore_slide(presentation_id: str, slide_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
+@app.post("/presentations/{presentation_id}/slides/{slide_id}/restore", dependencies=[Depends(get_owned_presentation)])
+def api_restore_slide(presentation_id: str, slide_id: str, db: Session = Depends(get_db)):
     ok = restore_slide(db, presentation_id, slide_id)
     if not ok:
         raise HTTPException(404, "Slide not found")
     return {"status": "success"}
 
 
-@app.get("/presentations/{presentation_id}/slides/{slide_id}")
-def api_get_slide(presentation_id: str, slide_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
+@app.get("/presentations/{presentation_id}/slides/{slide_id}", dependencies=[Depends(get_owned_presentation)])
+def api_get_slide(presentation_id: str, slide_id: str, db: Session = Depends(get_db)):
     slide = get_slide_by_id(db, presentation_id, slide_id)
     if not slide:
         raise HTTPException(404, "Slide not found")
-    return _slide_to_dict(slide)
+    return _slide_to_dict(slide, get_slide_index(db, slide))
 
 
-@app.delete("/presentations/{presentation_id}/slides/{slide_id}")
-def api_delete_slide(presentation_id: str, slide_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
+@app.delete("/presentations/{presentation_id}/slides/{slide_id}", dependencies=[Depends(get_owned_presentation)])
+def api_delete_slide(presentation_id: str, slide_id: str, db: Session = Depends(get_db)):
     ok = delete_slide_by_id(db, presentation_id, slide_id)
     if not ok:
         raise HTTPException(404, "Slide not found")
     return {"status": "success"}
 
 
+@app.patch("/presentations/{presentation_id}/slides/{slide_id}/position", dependencies=[Depends(get_owned_presentation)])
+def api_move_slide(presentation_id: str, slide_id: str, req: MoveSlideRequest, db: Session = Depends(get_db)):
+    """调整幻灯片顺序：移动到第 index 张。"""
+    ok = move_slide(db, presentation_id, slide_id, req.index)
+    if not ok:
+        raise HTTPException(404, "Slide not found")
+    return {"status": "success"}
+
+
+@app.post("/presentations/{presentation_id}/slides/batch", dependencies=[Depends(get_owned_presentation)])
+def api_batch_slide_operations(presentation_id: str, req: SlideBatchRequest, db: Session = Depends(get_db)):
+    """
+    批量调整幻灯片：按顺序执行 move / delete / restore / activate，一次归属校验、一个事务，任一项失败整体回滚。
+    返回操作后的幻灯片顺序。
+    """
+    for i, item in enumerate(req.operations):
+        if item.op not in SLIDE_OPERATIONS:
+            raise HTTPException(400, f"Operation {i}: op must be one of: {', '.join(SLIDE_OPERATIONS)}")
+        if item.op == "move" and item.index is None:
+            raise HTTPException(400, f"Operation {i}: move requires index")
+        if item.op == "activate" and not item.version_id:
+            raise HTTPException(400, f"Operation {i}: activate requires version_id")
+    try:
+        slides = apply_slide_operations(db, presentation_id, [item.dict() for item in req.operations])
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+    return {"status": "success", "slides": slides}
+
+
 @app.post("/presentations/{presentation_id}/slides")
-async def api_insert_slide(presentation_id: str, req: InsertSlideRequest, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    pres = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not pres:
-        raise HTTPException(404, "Presentation not found")
+async def api_insert_slide(presentation_id: str, req: InsertSlideRequest, db: Session = Depends(get_db), current_user = Depends(get_current_user), pres: dict = Depends(get_owned_presentation)):
     scores_per = get_scores_per_slide(db)
     if get_user_scores(db, current_user.id) < scores_per:
         raise HTTPException(402, f"积分不足：每张需 {scores_per} 积分")
@@ -915,10 +1082,7 @@ async def api_insert_slide(presentation_id: str, req: InsertSlideRequest, db: Se
 
 
 @app.post("/presentations/{presentation_id}/slides/insert")
-async def api_insert_slide_by_outline(presentation_id: str, req: InsertSlideByOutlineRequest, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    pres = get_presentation(db, presentation_id, user_id=current_user.id)
-    if not pres:
-        raise HTTPException(404, "Presentation not found")
+async def api_insert_slide_by_outline(presentation_id: str, req: InsertSlideByOutlineRequest, db: Session = Depends(get_db), current_user = Depends(get_current_user), pres: dict = Depends(get_owned_presentation)):
     scores_per = get_scores_per_slide(db)
     if get_user_scores(db, current_user.id) < scores_per:
         raise HTTPException(402, f"积分不足：每张需 {scores_per} 积分")
@@ -972,7 +1136,7 @@ async def api_insert_slide_by_outline(presentation_id: str, req: InsertSlideByOu
 
 # === Versions ===
 
-@app.post("/presentations/{presentation_id}/slides/{slide_id}/versions")
+@app.post("/presentations/{presentation_id}/slides/{slide_id}/versions", dependencies=[Depends(get_owned_presentation)])
 async def api_create_version(
     presentation_id: str,
     slide_id: str,
@@ -980,8 +1144,6 @@ async def api_create_version(
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user),
 ):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
     slide = get_slide_by_id(db, presentation_id, slide_id)
     if not slide:
         raise HTTPException(404, "Slide not found")
@@ -1021,38 +1183,31 @@ async def api_create_version(
     return {"status": "success", "version_id": version_id, "image_url": local_path}
 
 
-@app.get("/presentations/{presentation_id}/slides/{slide_id}/versions")
-def api_list_versions(presentation_id: str, slide_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
+@app.get("/presentations/{presentation_id}/slides/{slide_id}/versions", dependencies=[Depends(get_owned_presentation)])
+def api_list_versions(presentation_id: str, slide_id: str, db: Session = Depends(get_db)):
     slide = get_slide_by_id(db, presentation_id, slide_id)
     if not slide:
         raise HTTPException(404, "Slide not found")
     return {"versions": [_version_to_dict(v) for v in slide.versions]}
 
 
-@app.patch("/presentations/{presentation_id}/slides/{slide_id}/active-version")
+@app.patch("/presentations/{presentation_id}/slides/{slide_id}/active-version", dependencies=[Depends(get_owned_presentation)])
 def api_set_active_version(
     presentation_id: str,
     slide_id: str,
     req: SetActiveVersionRequest,
     db: Session = Depends(get_db),
-    current_user = Depends(get_current_user),
 ):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
     ok = set_slide_active_version(db, presentation_id, slide_id, req.version_id)
     if not ok:
         raise HTTPException(404, "Slide or version not found")
     return {"status": "success", "current_version_id": req.version_id}
 
 
-@app.delete("/presentations/{presentation_id}/slides/{slide_id}/versions/{version_id}")
+@app.delete("/presentations/{presentation_id}/slides/{slide_id}/versions/{version_id}", dependencies=[Depends(get_owned_presentation)])
 def api_delete_version(
-    presentation_id: str, slide_id: str, version_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)
+    presentation_id: str, slide_id: str, version_id: str, db: Session = Depends(get_db)
 ):
-    if not get_presentation(db, presentation_id, user_id=current_user.id):
-        raise HTTPException(404, "Presentation not found")
     ok = delete_slide_version(db, presentation_id, slide_id, version_id)
     if not ok:
         raise HTTPException(400, "Version not found or cannot delete the only version")
@@ -1126,6 +1281,7 @@ def admin_get_config(db: Session = Depends(get_db), current_admin = Depends(get_
     return {
         "scores_per_slide": int(scores_per_slide),
         "register_bonus_scores": register_bonus_scores,
+        "planner_stage_models": get_planner_stage_models(db),
     }
 
 
@@ -1135,9 +1291,32 @@ def admin_update_config(req: AdminConfigUpdateRequest, db: Session = Depends(get
         set_config(db, "scores_per_slide", str(max(1, req.scores_per_slide)))
     if req.register_bonus_scores is not None:
         set_config(db, "register_bonus_scores", str(max(0, req.register_bonus_scores)))
+    if req.planner_stage_models is not None:
+        planner.set_stage_models(req.planner_stage_models)
+        set_config(db, "planner_stage_models", json.dumps(planner.stage_models, ensure_ascii=False))
     return {"status": "success"}
 
 
+@app.get("/admin/planner/stats")
+def admin_planner_stats(current_admin = Depends(get_current_admin)):
+    """规划器各阶段使用的模型与耗时统计（进程内，重启清零）。"""
+    return {
+        "logic_model": planner.logic_model,
+        "fast_model": planner.fast_model,
+        "stage_models": {stage: planner.model_for_stage(stage) for stage in PLANNER_STAGES},
+        "stages": planner.get_stage_stats(),
+    }
+
+
+@app.get("/admin/generation/jobs")
+def admin_generation_jobs(db: Session = Depends(get_db), current_admin = Depends(get_current_admin)):
+    """生成任务队列概况：队列类型与 generation_jobs 各状态数量（local 队列不落库，计数为空）。"""
+    return {
+        "queue": os.getenv("GENERATION_QUEUE", "local").lower(),
+        "counts": count_generation_jobs(db),
+    }
+
+
 @app.post("/admin/redemption-codes")
 def admin_create_redemption_codes(req: AdminRedemptionCodesRequest, db: Session = Depends(get_db), current_admin = Depends(get_current_admin)):
     codes = create_redemption_codes(db, scores=req.scores, count=req.count, created_by_admin_id=current_admin.id)
@@ -1,11 +1,11 @@
 """
-SQLAlchemy ORM 模型：用户、管理员、演示文稿、幻灯片、版本、兑换码、邀请码、系统配置。
+SQLAlchemy ORM 模型：用户、管理员、演示文稿、幻灯片、版本、兑换码、邀请码、系统配置、积分预留、生成任务、大纲条目。
 """
 from datetime import datetime, timezone
 
 def _utc_now():
     return datetime.now(timezone.utc)
-from sqlalchemy import Column, String, Integer, Float, ForeignKey, DateTime, Text
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, DateTime, Text, Index
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -83,8 +83,20 @@ class Presentation(Base):
     params = Column(Text, nullable=True)  # 生成参数 JSON：language, presentation_mode, style_preset_id, audience, scene, attention, purpose, page_count
     is_published = Column(Integer, nullable=True, default=0)  # 0=未发布 1=已发布
     published_at = Column(DateTime, nullable=True)  # 发布时间
+    preview_image_path = Column(String(512), nullable=True)  # 封面：第一张未删除幻灯片的当前版本图片，随幻灯片/版本变更维护
+    plan_result = Column(Text, nullable=True)  # 最近一次规划结果 JSON（大纲、风格、自动标题），供断线重连取回
+    plan_error = Column(Text, nullable=True)  # 最近一次规划失败的错误信息
+    planned_at = Column(DateTime, nullable=True)  # 最近一次规划结束时间
 
     slides = relationship("Slide", back_populates="presentation", order_by="Slide.position", cascade="all, delete-orphan")
+    outline_items = relationship("OutlineItem", order_by="OutlineItem.item_index", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # 我的演示文稿 / 回收站：按用户过滤、deleted_at 区分，按创建或删除时间排序
+        Index("ix_presentations_user_list", "user_id", "deleted_at", "created_at"),
+        # 作品广场游标分页
+        Index("ix_presentations_gallery", "is_published", "published_at", "id"),
+    )
 
 
 class Slide(Base):
@@ -92,7 +104,7 @@ class Slide(Base):
 
     id = Column(String(36), primary_key=True)
     presentation_id = Column(String(36), ForeignKey("presentations.id", ondelete="CASCADE"), nullable=False)
-    position = Column(Integer, nullable=False, default=0)  # 从 0 开始
+    position = Column(Integer, nullable=False, default=0)  # 排序键，相邻幻灯片间留有间隔（见 repository.SLIDE_POSITION_GAP）；对外 index 为未删除幻灯片中的序号
     active_version_id = Column(String(36), nullable=True)  # 当前激活的 slide_version.id
     created_at = Column(DateTime, default=_utc_now)
     updated_at = Column(DateTime, default=_utc_now, onupdate=_utc_now)
@@ -101,6 +113,13 @@ class Slide(Base):
     presentation = relationship("Presentation", back_populates="slides")
     versions = relationship("SlideVersion", back_populates="slide", order_by="SlideVersion.version_number", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # 按演示文稿取未删除幻灯片并按 position 排序（get_slide_by_position、详情、封面计算）
+        Index("ix_slides_presentation_position", "presentation_id", "deleted_at", "position"),
+        # 插入/移动时在全部幻灯片（含已删除）中取紧邻的 position，避免与回收站中的幻灯片并列
+        Index("ix_slides_presentation_all_position", "presentation_id", "position"),
+    )
+
 
 class SlideVersion(Base):
     __tablename__ = "slide_versions"
@@ -115,6 +134,28 @@ class SlideVersion(Base):
 
     slide = relationship("Slide", back_populates="versions")
 
+    __table_args__ = (
+        # 某页的版本列表、版本计数与最新版本
+        Index("ix_slide_versions_slide_number", "slide_id", "version_number"),
+    )
+
+
+class OutlineItem(Base):
+    """大纲条目：每页的生成计划一行，记录生成状态与生成出的幻灯片；取代 params 中的整段 outline JSON。"""
+    __tablename__ = "outline_items"
+    __table_args__ = (
+        Index("ix_outline_items_presentation_index", "presentation_id", "item_index", unique=True),
+    )
+
+    id = Column(String(36), primary_key=True)
+    presentation_id = Column(String(36), ForeignKey("presentations.id", ondelete="CASCADE"), nullable=False)
+    item_index = Column(Integer, nullable=False)  # 大纲中的序号，从 0 开始
+    data = Column(Text, nullable=False)  # 该页的生成计划 JSON（title、visual_prompt、visual_subject 等）
+    status = Column(String(32), nullable=False, default="pending")  # pending | generated
+    slide_id = Column(String(36), nullable=True)  # 生成出的幻灯片
+    created_at = Column(DateTime, default=_utc_now)
+    updated_at = Column(DateTime, default=_utc_now, onupdate=_utc_now)
+
 
 class ScoreLog(Base):
     """积分使用日志：记录用户每次积分变动（充值或消费）、提示词和图片地址。"""
@@ -128,3 +169,39 @@ class ScoreLog(Base):
     image_path = Column(String(512), nullable=True)  # 图片相对路径，如 /images/xxx/yyy.png
     log_type = Column(String(32), nullable=False, default="consume")  # 类型：recharge（充值）或 consume（消费）
     created_at = Column(DateTime, default=_utc_now)
+
+
+class CreditReservation(Base):
+    """积分预留：批量生成受理时一次性冻结整套费用，每生成一页从预留中结算，结束时退回未用部分。"""
+    __tablename__ = "credit_reservations"
+    __table_args__ = (
+        # 清理无人结算的预留：WHERE status = 'held' AND updated_at < ?
+        Index("ix_credit_reservations_status_updated", "status", "updated_at"),
+    )
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(String(36), ForeignKey("users.id"), nullable=False, index=True)
+    presentation_id = Column(String(36), nullable=True)
+    reserved = Column(Integer, nullable=False)  # 冻结的积分总数（已从 users.scores 扣除）
+    consumed = Column(Integer, nullable=False, default=0)  # 已结算的积分
+    status = Column(String(32), nullable=False, default="held")  # held | released
+    created_at = Column(DateTime, default=_utc_now)
+    updated_at = Column(DateTime, default=_utc_now, onupdate=_utc_now)
+
+
+class GenerationJob(Base):
+    """生成任务队列：API 入队，worker 以租约方式领取；slides 随每页完成写回，租约过期后可由其他 worker 续跑。"""
+    __tablename__ = "generation_jobs"
+
+    id = Column(String(36), primary_key=True)
+    presentation_id = Column(String(36), ForeignKey("presentations.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(String(36), ForeignKey("users.id"), nullable=True)
+    slides = Column(Text, nullable=False)  # 入队时的待生成幻灯片 JSON；已完成的页以 outline_items.status 为准
+    status = Column(String(32), nullable=False, default="queued", index=True)  # queued | running | completed | failed
+    reservation_id = Column(String(36), nullable=True)  # 受理时冻结积分的预留记录（credit_reservations.id）
+    lease_owner = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=_utc_now)
+    updated_at = Column(DateTime, default=_utc_now, onupdate=_utc_now)
@@ -0,0 +1,214 @@
+"""
+事件驱动的进度总线：规划/生成线程发布进度，SSE 订阅方异步等待事件。
+订阅方不占用线程池线程，也不轮询；发布方可以在任意线程调用 publish。
+多 worker 部署时可传入共享状态存储：发布同时写入存储，各进程的中继任务只为本进程有订阅方的 channel
+读取存储并转发其他进程发布的事件。
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+# 订阅默认参数（秒）
+HEARTBEAT_INTERVAL = 15
+IDLE_TIMEOUT = 300
+# 最多记住多少个 channel 的最新事件
+MAX_LATEST = 10000
+# 跨进程中继读取共享存储的间隔
+RELAY_INTERVAL = float(os.getenv("PROGRESS_RELAY_INTERVAL", "0.5"))
+RELAY_NAMESPACE = "progress_bus"
+
+
+class ProgressBus:
+    """
+    进程内的按 channel 发布/订阅。
+
+    - publish(channel, event, data)：线程安全；记录该 channel 的最新事件并推送给所有订阅方。
+    - subscribe(channel)：异步迭代 (event, data)；先回放最新事件，空闲时产出 ("heartbeat", None)，
+      超过 idle_timeout 无事件产出 ("timeout", None) 后结束，收到终止事件后结束。
+    - store：共享状态存储（store.shared 为 True 时启用跨进程中继）；中继只转发各 channel 的最新事件，
+      两次读取之间的中间事件会被合并。
+    """
+
+    def __init__(self, queue_size: int = 100, max_latest: int = MAX_LATEST, store=None, relay_interval: float = RELAY_INTERVAL):
+        self._queue_size = queue_size
+        self._max_latest = max_latest
+        self._store = store if getattr(store, "shared", False) else None
+        self._relay_interval = relay_interval
+        self._origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._seq = 0
+        self._seen: Dict[str, str] = {}
+        self._relay_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._latest: "OrderedDict[str, Tuple[str, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """绑定事件循环（应用启动时调用），其他线程的发布将投递到该循环；有共享存储时启动中继任务。"""
+        self._loop = loop
+        if self._store is not None and self._relay_task is None:
+            self._relay_task = loop.create_task(self._relay())
+
+    def publish(self, channel: str, event: str, data: dict) -> None:
+        with self._lock:
+            self._latest[channel] = (event, data)
+            self._latest.move_to_end(channel)
+            while len(self._latest) > self._max_latest:
+                self._latest.popitem(last=False)
+            if self._store is not None:
+                self._seq += 1
+                entry_id = f"{self._origin}:{self._seq}"
+                self._seen[channel] = entry_id
+        if self._store is not None:
+            try:
+                self._store.set(RELAY_NAMESPACE, channel, {"id": entry_id, "event": event, "data": data})
+            except Exception as e:
+                print(f"Progress bus store write failed: {e}")
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(channel, event, data)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, channel, event, data)
+
+    def latest(self, channel: str) -> Optional[Tuple[str, dict]]:
+        """
+        返回 channel 的最新事件。有共享存储时以存储为准：本进程记住的可能是上一轮（其他进程已开始新一轮），
+        只在存储读取失败时退回本进程记录。
+        """
+        if self._store is None:
+            with self._lock:
+                return self._latest.get(channel)
+        try:
+            entry = self._store.get(RELAY_NAMESPACE, channel)
+        except Exception as e:
+            print(f"Progress bus store read failed: {e}")
+            with self._lock:
+                return self._latest.get(channel)
+        with self._lock:
+            if entry is None:
+                # 存储中已过期或被清除，本进程的记录同样过时
+                self._latest.pop(channel, None)
+                return None
+            if self._seen.get(channel) != entry["id"]:
+                self._seen[channel] = entry["id"]
+                self._latest[channel] = (entry["event"], entry["data"])
+                self._latest.move_to_end(channel)
+            return (entry["event"], entry["data"])
+
+    def forget(self, channel: str) -> None:
+        """丢弃 channel 的最新事件（不影响已订阅方）。"""
+        with self._lock:
+            self._latest.pop(channel, None)
+        if self._store is not None:
+            self._store.delete(RELAY_NAMESPACE, channel)
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self._subscribers.get(channel, ()))
+
+    def _dispatch(self, channel: str, event: str, data: dict) -> None:
+        for q in list(self._subscribers.get(channel, ())):
+            if q.full():
+                # 慢消费者只保留最近的事件
+                try:
+                    q.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            q.put_nowait((event, data))
+
+    def _read_shared(self, channels) -> list:
+        entries = []
+        for channel in channels:
+            entry = self._store.get(RELAY_NAMESPACE, channel)
+            if entry is not None:
+                entries.append((channel, entry))
+        return entries
+
+    async def _relay(self) -> None:
+        """跨进程中继：只读取本进程有订阅方的 channel，转发其他进程发布的新事件。"""
+        while True:
+            await asyncio.sleep(self._relay_interval)
+            channels = list(self._subscribers)
+            if not channels:
+                with self._lock:
+                    self._seen.clear()
+                continue
+            try:
+                entries = await asyncio.to_thread(self._read_shared, channels)
+            except Exception as e:
+                print(f"Progress bus relay failed: {e}")
+                continue
+            for channel, entry in entries:
+                with self._lock:
+                    if self._seen.get(channel) == entry["id"]:
+                        continue
+                    self._seen[channel] = entry["id"]
+                    if entry["id"].startswith(self._origin + ":"):
+                        # 本进程发布的事件已直接分发
+                        continue
+                    self._latest[channel] = (entry["event"], entry["data"])
+                    self._latest.move_to_end(channel)
+                self._dispatch(channel, entry["event"], entry["data"])
+            with self._lock:
+                for channel in [c for c in self._seen if c not in self._subscribers]:
+                    del self._seen[channel]
+
+    async def subscribe(
+        self,
+        channel: str,
+        terminal_events: Tuple[str, ...] = ("done", "failed"),
+        heartbeat: float = HEARTBEAT_INTERVAL,
+        idle_timeout: float = IDLE_TIMEOUT,
+        replay_latest: bool = True,
+    ) -> AsyncIterator[Tuple[str, Optional[dict]]]:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        self._subscribers.setdefault(channel, set()).add(q)
+        try:
+            if replay_latest:
+                latest = self.latest(channel)
+                if latest is not None:
+                    yield latest
+                    if latest[0] in terminal_events:
+                        return
+            loop = asyncio.get_running_loop()
+            idle_deadline = loop.time() + idle_timeout
+            while True:
+                remaining = idle_deadline - loop.time()
+                if remaining <= 0:
+                    yield ("timeout", None)
+                    return
+                try:
+                    event, data = await asyncio.wait_for(q.get(), timeout=min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    if loop.time() < idle_deadline:
+                        yield ("heartbeat", None)
+                    continue
+                idle_deadline = loop.time() + idle_timeout
+                yield (event, data)
+                if event in terminal_events:
+                    return
+        finally:
+            subs = self._subscribers.get(channel)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    self._subscribers.pop(channel, None)
+
+
+def format_sse(event: str, data: Optional[dict]) -> str:
+    """格式化为 SSE 文本帧；心跳使用注释行，不触发前端事件回调。"""
+    if event == "heartbeat":
+        return ": ping\n\n"
+    payload = json.dumps(data if data is not None else {}, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
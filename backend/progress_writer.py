@@ -0,0 +1,82 @@
+"""
+生成进度的写回缓冲：进度先经 ProgressBus 即时推送，落库则按演示文稿合并，由后台线程定时批量写入。
+
+- write()：只记录该演示文稿最新的进度，不访问数据库；同一周期内的多次更新只落库最后一次；
+- write_through()：立即落库（受理任务、completed / failed 等终止状态），并丢弃该演示文稿尚未写入的旧进度；
+- 每个周期（GENERATION_PROGRESS_FLUSH_INTERVAL 秒）把所有待写进度放在一个事务中提交，
+  落库次数随时间增长，而不随生成的页数增长；进程退出时写入剩余进度。
+"""
+import atexit
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from repository import update_generation_progress, update_generation_progress_many
+
+FLUSH_INTERVAL = float(os.getenv("GENERATION_PROGRESS_FLUSH_INTERVAL", "2.0"))
+
+
+class ProgressWriter:
+    """按演示文稿合并的进度写回缓冲，线程安全；后台线程在第一次 write 时启动。"""
+
+    def __init__(self, interval: float = FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending: Dict[str, Tuple[str, int, int, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        # 串行化落库：定时批量写入与立即写入不会交错，旧进度不会覆盖终止状态
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self, presentation_id: str, status: str, current: int, total: int, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._pending[presentation_id] = (status, current, total, error)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def write_through(
+        self,
+        db: Session,
+        presentation_id: str,
+        status: str,
+        current: int,
+        total: int,
+        error: Optional[str] = None,
+    ) -> bool:
+        with self._write_lock:
+            with self._lock:
+                self._pending.pop(presentation_id, None)
+            return update_generation_progress(db, presentation_id, status, current, total, error=error)
+
+    def flush(self) -> int:
+        """把待写进度在一个事务中写入，返回写入的演示文稿数。"""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            db = SessionLocal()
+            try:
+                return update_generation_progress_many(db, pending)
+            except Exception as e:
+                print(f"Flush generation progress failed: {e}")
+                # 未写入的进度放回缓冲，期间若有更新的进度则以新的为准
+                with self._lock:
+                    for presentation_id, progress in pending.items():
+                        self._pending.setdefault(presentation_id, progress)
+                return 0
+            finally:
+                db.close()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
@@ -2,16 +2,18 @@
 数据访问层：演示文稿、幻灯片、版本的 CRUD。
 """
 import os
+import json
+import base64
 import shutil
 import uuid
 import secrets
-from datetime import datetime, timezone
-from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, aliased, load_only, selectinload
+from sqlalchemy import and_, or_, func, tuple_, update, bindparam
 
-from models import Presentation, Slide, SlideVersion, User, Admin, RedemptionCode, InviteCode, SystemConfig, ScoreLog
+from models import Presentation, Slide, SlideVersion, User, Admin, RedemptionCode, InviteCode, SystemConfig, ScoreLog, CreditReservation, GenerationJob, OutlineItem
 
 
 def _version_to_dict(v: SlideVersion) -> dict:
@@ -25,33 +27,142 @@ def _version_to_dict(v: SlideVersion) -> dict:
     }
 
 
-def _slide_to_dict(s: Slide) -> dict:
+def _slide_to_dict(s: Slide, index: int) -> dict:
+    """index 为幻灯片在未删除幻灯片中的序号（Slide.position 只是带间隔的排序键，不对外暴露）。"""
     versions = [_version_to_dict(v) for v in s.versions]
     active = s.active_version_id or (versions[-1]["id"] if versions else None)
     return {
         "slide_id": s.id,
-        "index": s.position,
-        "position": s.position,
+        "index": index,
+        "position": index,
         "active_version_id": active,
+        "version_count": len(versions),
         "versions": versions,
     }
 
 
+def _load_active_versions(db: Session, slides: List[Slide]) -> Tuple[Dict[str, SlideVersion], Dict[str, int]]:
+    """
+    批量取每张幻灯片的当前版本（未设置时取最新版本）与版本数，不加载完整版本历史。
+    返回 ({slide_id: SlideVersion}, {slide_id: version_count})，共两到三条查询。
+    """
+    if not slides:
+        return {}, {}
+    slide_ids = [s.id for s in slides]
+    stats = (
+        db.query(SlideVersion.slide_id, func.count(SlideVersion.id), func.max(SlideVersion.version_number))
+        .filter(SlideVersion.slide_id.in_(slide_ids))
+        .group_by(SlideVersion.slide_id)
+        .all()
+    )
+    counts = {slide_id: count for slide_id, count, _ in stats}
+    latest = {slide_id: number for slide_id, _, number in stats}
+    active_ids = [s.active_version_id for s in slides if s.active_version_id]
+    fallback = [(s.id, latest[s.id]) for s in slides if not s.active_version_id and s.id in latest]
+    rows = []
+    if active_ids:
+        rows += db.query(SlideVersion).filter(SlideVersion.id.in_(active_ids)).all()
+    if fallback:
+        rows += (
+            db.query(SlideVersion)
+            .filter(tuple_(SlideVersion.slide_id, SlideVersion.version_number).in_(fallback))
+            .all()
+        )
+    by_id = {v.id: v for v in rows}
+    active = {}
+    for s in slides:
+        if s.active_version_id:
+            v = by_id.get(s.active_version_id)
+        else:
+            v = next((r for r in rows if r.slide_id == s.id and r.version_number == latest.get(s.id)), None)
+        if v is not None:
+            active[s.id] = v
+    return active, counts
+
+
+def _mark_public_change(db: Session, presentation_id: str, list_changed: bool = False) -> None:
+    """
+    记录本次事务改动了哪个已发布演示文稿的公开内容（详情页；list_changed 表示作品广场列表项也变了）。
+    提交成功后由作品广场缓存（gallery_cache）按记录精确失效，回滚则丢弃。
+    """
+    touched = db.info.setdefault("public_changes", {})
+    touched[presentation_id] = touched.get(presentation_id, False) or list_changed
+
+
+def _refresh_preview_image(db: Session, presentation_id: str) -> None:
+    """
+    重新计算演示文稿封面 preview_image_path：第一张未删除幻灯片的当前版本图片（无当前版本时取最新版本）。
+    在新增/切换版本、删除/恢复幻灯片后、调用方 commit 前执行，列表接口直接读该列。
+    """
+    db.flush()
+    first = (
+        db.query(Slide.id, Slide.active_version_id)
+        .filter(and_(Slide.presentation_id == presentation_id, Slide.deleted_at == None))
+        .order_by(Slide.position)
+        .first()
+    )
+    preview = None
+    if first:
+        row = None
+        if first.active_version_id:
+            row = db.query(SlideVersion.image_path).filter(SlideVersion.id == first.active_version_id).first()
+        if row is None:
+            row = (
+                db.query(SlideVersion.image_path)
+                .filter(SlideVersion.slide_id == first.id)
+                .order_by(SlideVersion.version_number.desc())
+                .first()
+            )
+        preview = row[0] if row else None
+    current = (
+        db.query(Presentation.preview_image_path, Presentation.is_published)
+        .filter(Presentation.id == presentation_id)
+        .first()
+    )
+    if current and current.is_published == 1:
+        _mark_public_change(db, presentation_id, list_changed=current.preview_image_path != preview)
+    if current and current.preview_image_path == preview:
+        return
+    db.query(Presentation).filter(Presentation.id == presentation_id).update(
+        {Presentation.preview_image_path: preview}, synchronize_session=False
+    )
+
+
+# 列表接口只读取这些列，避免加载 params 以外的大字段（如 plan_result）
+_LIST_COLUMNS = (
+    Presentation.id,
+    Presentation.user_id,
+    Presentation.title,
+    Presentation.topic,
+    Presentation.created_at,
+    Presentation.updated_at,
+    Presentation.deleted_at,
+    Presentation.generation_status,
+    Presentation.generation_current,
+    Presentation.generation_total,
+    Presentation.params,
+    Presentation.is_published,
+    Presentation.published_at,
+    Presentation.preview_image_path,
+)
+
+
 # ---------- Presentations ----------
 
 
 def list_presentations(db: Session, user_id: Optional[str] = None) -> List[dict]:
-    q = db.query(Presentation).filter(Presentation.deleted_at == None).order_by(Presentation.created_at.desc())
+    q = (
+        db.query(Presentation)
+        .options(load_only(*_LIST_COLUMNS))
+        .filter(Presentation.deleted_at == None)
+        .order_by(Presentation.created_at.desc())
+    )
     if user_id is not None:
         q = q.filter(Presentation.user_id == user_id)
     rows = q.all()
     result = []
     for p in rows:
-        preview = None
-        if p.slides:
-            first_slide = min(p.slides, key=lambda s: s.position)
-            if first_slide.versions:
-                preview = first_slide.versions[-1].image_path
+        preview = p.preview_image_path
         _topic = getattr(p, "topic", None) or p.title
         item = {
             "id": p.id,
@@ -84,19 +195,48 @@ def create_presentation(
     return pid
 
 
+PRESENTATION_VIEWS = ("summary", "full")
+
+
 def get_presentation(
     db: Session,
     presentation_id: str,
     user_id: Optional[str] = None,
+    view: str = "full",
 ) -> Optional[dict]:
+    """
+    view=full：每张幻灯片带完整版本历史；
+    view=summary：versions 只含当前版本，另带 version_count，历史按需从 /versions 接口获取。
+    """
     p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
     if not p:
         return None
     if user_id is not None and getattr(p, "user_id", None) != user_id:
         return None
-    # 只包含未删除的幻灯片
-    active_slides = sorted([s for s in p.slides if s.deleted_at is None], key=lambda x: x.position)
-    slides_data = [_slide_to_dict(s) for s in active_slides]
+    if view == "summary":
+        # 只包含未删除的幻灯片
+        active_slides = (
+            db.query(Slide)
+            .filter(and_(Slide.presentation_id == presentation_id, Slide.deleted_at == None))
+            .order_by(Slide.position)
+            .all()
+        )
+        active_versions, counts = _load_active_versions(db, active_slides)
+        slides_data = []
+        for i, s in enumerate(active_slides):
+            v = active_versions.get(s.id)
+            slides_data.append({
+                "slide_id": s.id,
+                "index": i,
+                "position": i,
+                "active_version_id": v.id if v else None,
+                "version_count": counts.get(s.id, 0),
+                "versions": [_version_to_dict(v)] if v else [],
+            })
+    else:
+        # 只包含未删除的幻灯片
+        active_slides = sorted([s for s in p.slides if s.deleted_at is None], key=lambda x: x.position)
+        slides_data = [_slide_to_dict(s, i) for i, s in enumerate(active_slides)]
     _topic = getattr(p, "topic", None) or p.title
     return {
         "id": p.id,
@@ -112,6 +252,48 @@ def get_presentation(
     }
 
 
+def get_presentation_meta(
+    db: Session,
+    presentation_id: str,
+    user_id: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    只取演示文稿的标量列（不加载幻灯片与版本），按主键单行查询；user_id 不匹配时返回 None。
+    用于归属校验以及只需要标题、风格、参数等字段的接口。
+    """
+    q = db.query(
+        Presentation.id,
+        Presentation.user_id,
+        Presentation.title,
+        Presentation.topic,
+        Presentation.global_style,
+        Presentation.params,
+        Presentation.generation_status,
+        Presentation.generation_current,
+        Presentation.generation_total,
+        Presentation.is_published,
+        Presentation.deleted_at,
+    ).filter(Presentation.id == presentation_id)
+    if user_id is not None:
+        q = q.filter(Presentation.user_id == user_id)
+    row = q.first()
+    if not row:
+        return None
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "topic": row.topic or row.title,
+        "title": row.title,
+        "global_style": row.global_style,
+        "params": row.params,
+        "generation_status": row.generation_status or "idle",
+        "generation_current": row.generation_current or 0,
+        "generation_total": row.generation_total or 0,
+        "is_published": row.is_published or 0,
+        "deleted_at": row.deleted_at,
+    }
+
+
 def update_generation_progress(
     db: Session,
     presentation_id: str,
@@ -120,17 +302,52 @@ def update_generation_progress(
     total: int = 0,
     error: Optional[str] = None,
 ) -> bool:
-    """更新演示文稿的生成进度。"""
-    p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
-    if not p:
-        return False
-    p.generation_status = status
-    p.generation_current = current
-    p.generation_total = total
-    p.generation_error = error
-    p.updated_at = datetime.now(timezone.utc)
+    """更新演示文稿的生成进度（单条 UPDATE，不先查询）。"""
+    n = (
+        db.query(Presentation)
+        .filter(Presentation.id == presentation_id)
+        .update(
+            {
+                Presentation.generation_status: status,
+                Presentation.generation_current: current,
+                Presentation.generation_total: total,
+                Presentation.generation_error: error,
+                Presentation.updated_at: datetime.now(timezone.utc),
+            },
+            synchronize_session=False,
+        )
+    )
     db.commit()
-    return True
+    return n > 0
+
+
+def update_generation_progress_many(db: Session, progress: Dict[str, tuple]) -> int:
+    """
+    批量写入多个演示文稿的生成进度，progress 为 {presentation_id: (status, current, total, error)}；
+    所有更新在一个事务中提交，返回写入条数。
+    """
+    if not progress:
+        return 0
+    table = Presentation.__table__
+    now = datetime.now(timezone.utc)
+    # Core 的 executemany：已被彻底删除的演示文稿只是不命中，不会像 ORM 批量更新那样报 StaleDataError
+    db.execute(
+        update(table)
+        .where(table.c.id == bindparam("pid"))
+        .values(
+            generation_status=bindparam("status"),
+            generation_current=bindparam("current"),
+            generation_total=bindparam("total"),
+            generation_error=bindparam("error"),
+            updated_at=now,
+        ),
+        [
+            {"pid": presentation_id, "status": status, "current": current, "total": total, "error": error}
+            for presentation_id, (status, current, total, error) in progress.items()
+        ],
+    )
+    db.commit()
+    return len(progress)
 
 
 def get_generation_progress(db: Session, presentation_id: str) -> Optional[dict]:
@@ -165,6 +382,8 @@ def update_presentation(
     p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
     if not p:
         return False
+    if p.is_published == 1:
+        _mark_public_change(db, presentation_id, list_changed=title is not None or is_published is not None)
     if title is not None:
         p.title = title
     if global_style is not None:
@@ -180,6 +399,66 @@ def update_presentation(
     return True
 
 
+def save_plan_result(db: Session, presentation_id: str, plan: dict) -> bool:
+    """保存规划结果（同时清除上次的失败信息）。"""
+    p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
+    if not p:
+        return False
+    now = datetime.now(timezone.utc)
+    p.plan_result = json.dumps(plan, ensure_ascii=False)
+    p.plan_error = None
+    p.planned_at = now
+    p.updated_at = now
+    db.commit()
+    return True
+
+
+def clear_plan_result(db: Session, presentation_id: str) -> bool:
+    """新一轮规划开始时清除上次的规划结果与失败信息，规划结束前重连方不会取到上一轮的大纲。"""
+    n = (
+        db.query(Presentation)
+        .filter(Presentation.id == presentation_id)
+        .update({Presentation.plan_result: None, Presentation.plan_error: None}, synchronize_session=False)
+    )
+    db.commit()
+    return n > 0
+
+
+def save_plan_error(db: Session, presentation_id: str, error: str) -> bool:
+    """记录规划失败（同时清除上次的规划结果，避免重连方取到过期大纲）。"""
+    p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
+    if not p:
+        return False
+    now = datetime.now(timezone.utc)
+    p.plan_result = None
+    p.plan_error = error
+    p.planned_at = now
+    p.updated_at = now
+    db.commit()
+    return True
+
+
+def get_plan_result(db: Session, presentation_id: str) -> Optional[dict]:
+    """获取最近一次规划的结果或错误：{"plan", "error", "planned_at"}；演示文稿不存在返回 None。"""
+    row = (
+        db.query(Presentation.plan_result, Presentation.plan_error, Presentation.planned_at)
+        .filter(Presentation.id == presentation_id)
+        .first()
+    )
+    if not row:
+        return None
+    plan_result, plan_error, planned_at = row
+    try:
+        plan = json.loads(plan_result) if plan_result else None
+    except ValueError:
+        plan = None
+    return {
+        "plan": plan,
+        "error": plan_error,
+        "planned_at": planned_at.isoformat() if planned_at else None,
+    }
+
+
 def set_presentation_published(
     db: Session,
     presentation_id: str,
@@ -189,6 +468,7 @@ def set_presentation_published(
     p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
     if not p:
         return False
+    _mark_public_change(db, presentation_id, list_changed=True)
     p.is_published = 1 if is_published else 0
     if is_published:
         p.published_at = datetime.now(timezone.utc)
@@ -199,34 +479,61 @@ def set_presentation_published(
     return True
 
 
+def _encode_gallery_cursor(published_at: datetime, presentation_id: str) -> str:
+    raw = f"{published_at.isoformat()}|{presentation_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_gallery_cursor(cursor: str) -> Optional[tuple]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        published_at, presentation_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(published_at), presentation_id
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
 def list_published_presentations(
     db: Session,
     skip: int = 0,
     limit: int = 20,
-) -> List[dict]:
-    """列出已发布的演示文稿（公开）。"""
+    cursor: Optional[str] = None,
+) -> tuple[List[dict], Optional[str]]:
+    """
+    列出已发布的演示文稿（公开），按 (published_at, id) 倒序做游标分页，返回 (列表, next_cursor)。
+    用户名来自同一查询的 join，封面来自 preview_image_path，每页只执行一次查询；
+    无 cursor 时兼容旧的 skip 偏移分页。next_cursor 为 None 表示没有更多。
+    """
     q = (
-        db.query(Presentation)
+        db.query(Presentation, User.username)
+        .options(load_only(*_LIST_COLUMNS))
         .join(User, Presentation.user_id == User.id)
         .filter(Presentation.deleted_at == None)
         .filter(Presentation.is_published == 1)
-        .order_by(Presentation.published_at.desc())
+        .filter(Presentation.published_at != None)
+        .order_by(Presentation.published_at.desc(), Presentation.id.desc())
     )
-    total = q.count()
-    rows = q.offset(skip).limit(limit).all()
+    if cursor:
+        decoded = _decode_gallery_cursor(cursor)
+        if decoded is None:
+            raise ValueError("Invalid cursor")
+        published_at, presentation_id = decoded
+        q = q.filter(
+            or_(
+                Presentation.published_at < published_at,
+                and_(Presentation.published_at == published_at, Presentation.id < presentation_id),
+            )
+        )
+    elif skip:
+        q = q.offset(skip)
+    # 多取一条判断是否还有下一页
+    rows = q.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     result = []
-    for p in rows:
-        preview = None
-        if p.slides:
-            first_slide = min(p.slides, key=lambda s: s.position)
-            if first_slide.versions:
-                preview = first_slide.versions[-1].image_path
+    for p, username in rows:
+        preview = p.preview_image_path
         _topic = getattr(p, "topic", None) or p.title
-        # 获取用户名
-        username = None
-        if p.user_id:
-            user = db.query(User).filter(User.id == p.user_id).first()
-            username = user.username if user else None
         item = {
             "id": p.id,
             "topic": _topic,
@@ -238,7 +545,11 @@ def list_published_presentations(
             "user_id": getattr(p, "user_id", None),
         }
         result.append(item)
-    return result
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1][0]
+        next_cursor = _encode_gallery_cursor(last.published_at, last.id)
+    return result, next_cursor
 
 
 def get_presentation_public(
@@ -253,28 +564,25 @@ def get_presentation_public(
     if getattr(p, "is_published", None) != 1 or p.deleted_at is not None:
         return None
     # 只包含未删除的幻灯片
-    active_slides = sorted([s for s in p.slides if s.deleted_at is None], key=lambda x: x.position)
+    active_slides = (
+        db.query(Slide)
+        .filter(and_(Slide.presentation_id == presentation_id, Slide.deleted_at == None))
+        .order_by(Slide.position)
+        .all()
+    )
     # 只返回当前激活版本，不暴露版本历史
+    active_versions, _ = _load_active_versions(db, active_slides)
     slides_data = []
-    for s in active_slides:
-        active_version_id = s.active_version_id or (s.versions[-1].id if s.versions else None)
-        if active_version_id:
-            active_version = next((v for v in s.versions if v.id == active_version_id), None)
-            if active_version:
-                slides_data.append({
-                    "slide_id": s.id,
-                    "index": s.position,
-                    "position": s.position,
-                    "active_version_id": active_version_id,
-                    "versions": [{
-                        "id": active_version.id,
-                        "image_url": active_version.image_path,
-                        "prompt": active_version.prompt,
-                        "base_image_url": active_version.base_image_path,
-                        "version_number": active_version.version_number,
-                        "timestamp": active_version.created_at.timestamp() if active_version.created_at else 0,
-                    }],
-                })
+    for i, s in enumerate(active_slides):
+        active_version = active_versions.get(s.id)
+        if active_version:
+            slides_data.append({
+                "slide_id": s.id,
+                "index": i,
+                "position": i,
+                "active_version_id": active_version.id,
+                "versions": [_version_to_dict(active_version)],
+            })
     _topic = getattr(p, "topic", None) or p.title
     # 获取用户名
     username = None
@@ -301,6 +609,8 @@ def delete_presentation(db: Session, presentation_id: str) -> bool:
     p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
     if not p:
         return False
+    if p.is_published == 1:
+        _mark_public_change(db, presentation_id, list_changed=True)
     p.deleted_at = datetime.now(timezone.utc)
     db.commit()
     return True
@@ -310,23 +620,26 @@ def restore_presentation(db: Session, presentation_id: str) -> bool:
     p = db.query(Presentation).filter(Presentation.id == presentation_id).first()
     if not p:
         return False
+    if p.is_published == 1:
+        _mark_public_change(db, presentation_id, list_changed=True)
     p.deleted_at = None
     db.commit()
     return True
 
 
 def list_deleted_presentations(db: Session, user_id: Optional[str] = None) -> List[dict]:
-    q = db.query(Presentation).filter(Presentation.deleted_at != None).order_by(Presentation.deleted_at.desc())
+    q = (
+        db.query(Presentation)
+        .options(load_only(*_LIST_COLUMNS))
+        .filter(Presentation.deleted_at != None)
+        .order_by(Presentation.deleted_at.desc())
+    )
     if user_id is not None:
         q = q.filter(Presentation.user_id == user_id)
     rows = q.all()
     result = []
     for p in rows:
-        preview = None
-        if p.slides:
-            first_slide = min(p.slides, key=lambda s: s.position)
-            if first_slide.versions:
-                preview = first_slide.versions[-1].image_path
+        preview = p.preview_image_path
         _topic = getattr(p, "topic", None) or p.title
         result.append({
             "id": p.id,
@@ -388,7 +701,7 @@ def list_all_presentations_admin(
     limit: int = 100,
 ) -> tuple[list[dict], int]:
     """管理员：列出所有用户的演示稿，可选按 user_id 筛选、分页，同时返回总数。"""
-    q = db.query(Presentation).filter(Presentation.deleted_at == None)
+    q = db.query(Presentation).options(load_only(*_LIST_COLUMNS)).filter(Presentation.deleted_at == None)
     if user_id_filter is not None:
         q = q.filter(Presentation.user_id == user_id_filter)
     total = q.count()
@@ -405,11 +718,7 @@ def list_all_presentations_admin(
         if uid:
             u = db.query(User).filter(User.id == uid).first()
             username = u.username if u else None
-        preview = None
-        if p.slides:
-            first_slide = min(p.slides, key=lambda s: s.position)
-            if first_slide.versions:
-                preview = first_slide.versions[-1].image_path
+        preview = p.preview_image_path
         _topic = getattr(p, "topic", None) or p.title
         result.append(
             {
@@ -430,6 +739,80 @@ def list_all_presentations_admin(
     return result, total
 
 
+# ---------- Outline Items (大纲条目) ----------
+
+
+def replace_outline_items(db: Session, presentation_id: str, items: list) -> int:
+    """
+    用新的大纲替换演示文稿的全部大纲条目，返回条目数。
+    条目状态重置为 pending（带 _generated 标记的为 generated），_generated 本身不写入 data。
+    """
+    db.query(OutlineItem).filter(OutlineItem.presentation_id == presentation_id).delete(synchronize_session=False)
+    for index, item in enumerate(items):
+        data = {k: v for k, v in item.items() if k != "_generated"}
+        db.add(OutlineItem(
+            id=str(uuid.uuid4()),
+            presentation_id=presentation_id,
+            item_index=index,
+            data=json.dumps(data, ensure_ascii=False),
+            status="generated" if item.get("_generated") else "pending",
+        ))
+    db.commit()
+    return len(items)
+
+
+def list_outline_items(db: Session, presentation_id: str, with_status: bool = False) -> List[dict]:
+    """
+    按序返回大纲条目的生成计划；已生成的条目带 _generated 标记（与生成任务的 slides 格式一致）。
+    with_status=True 时另附 index、status、slide_id，供接口返回。
+    """
+    rows = (
+        db.query(OutlineItem.item_index, OutlineItem.data, OutlineItem.status, OutlineItem.slide_id)
+        .filter(OutlineItem.presentation_id == presentation_id)
+        .order_by(OutlineItem.item_index)
+        .all()
+    )
+    items = []
+    for row in rows:
+        try:
+            item = json.loads(row.data)
+        except (TypeError, ValueError):
+            item = {}
+        if row.status == "generated":
+            item["_generated"] = True
+        if with_status:
+            item.update({"index": row.item_index, "status": row.status, "slide_id": row.slide_id})
+        items.append(item)
+    return items
+
+
+def list_generated_outline_indexes(db: Session, presentation_id: str) -> set:
+    """已生成的大纲条目序号（只读 item_index，不加载每页的生成计划），供生成任务启动或被接手时恢复跳过列表。"""
+    rows = (
+        db.query(OutlineItem.item_index)
+        .filter(OutlineItem.presentation_id == presentation_id, OutlineItem.status == "generated")
+        .all()
+    )
+    return {row[0] for row in rows}
+
+
+def _mark_outline_item_generated(db: Session, presentation_id: str, item_index: int, slide_id: Optional[str]) -> bool:
+    """把一个大纲条目标记为已生成并关联幻灯片（只更新这一行，不提交）。"""
+    n = (
+        db.query(OutlineItem)
+        .filter(OutlineItem.presentation_id == presentation_id, OutlineItem.item_index == item_index)
+        .update(
+            {
+                OutlineItem.status: "generated",
+                OutlineItem.slide_id: slide_id,
+                OutlineItem.updated_at: datetime.now(timezone.utc),
+            },
+            synchronize_session=False,
+        )
+    )
+    return n > 0
+
+
 # ---------- Slides ----------
 
 
@@ -444,19 +827,104 @@ def get_slide_by_id(
     return q.first()
 
 
+# Slide.position 是带间隔的整数排序键：插入取前后邻居的中点，移动只改被移动的一行；
+# 相邻间隔用尽时整份演示文稿重新按间隔编号（很少发生）。对外的 index 始终是未删除幻灯片中的序号：
+# 按序号定位需沿索引跳过前 index 个索引项（不加载这些行），已知 slide_id 的调用方应按主键定位。
+SLIDE_POSITION_GAP = 1024
+
+
+def _active_slides_query(db: Session, presentation_id: str, exclude_slide_id: Optional[str] = None):
+    q = db.query(Slide).filter(and_(Slide.presentation_id == presentation_id, Slide.deleted_at == None))
+    if exclude_slide_id is not None:
+        q = q.filter(Slide.id != exclude_slide_id)
+    return q
+
+
 def get_slide_by_position(db: Session, presentation_id: str, position: int) -> Optional[Slide]:
-    """返回「未删除的幻灯片按 position 排序」后的第 position 张（从 0 开始）。"""
-    rows = (
-        db.query(Slide)
-        .filter(
-            and_(Slide.presentation_id == presentation_id, Slide.deleted_at == None)
-        )
+    """返回「未删除的幻灯片按 position 排序」后的第 position 张（从 0 开始），沿索引跳过前 position 项，只加载一行。"""
+    if position < 0:
+        return None
+    return (
+        _active_slides_query(db, presentation_id)
         .order_by(Slide.position)
+        .offset(position)
+        .limit(1)
+        .first()
+    )
+
+
+def get_slide_index(db: Session, slide: Slide) -> int:
+    """幻灯片在未删除幻灯片中的序号；已删除的幻灯片返回恢复后所在的序号。"""
+    return (
+        _active_slides_query(db, slide.presentation_id, exclude_slide_id=slide.id)
+        .filter(Slide.position < slide.position)
+        .count()
+    )
+
+
+def _rebalance_slide_positions(db: Session, presentation_id: str) -> None:
+    """按当前顺序（含已删除的幻灯片）重新以 SLIDE_POSITION_GAP 为间隔编号。"""
+    db.flush()
+    rows = (
+        db.query(Slide.id)
+        .filter(Slide.presentation_id == presentation_id)
+        .order_by(Slide.position, Slide.created_at, Slide.id)
         .all()
     )
-    if position < 0 or position >= len(rows):
-        return None
-    return rows[position]
+    db.bulk_update_mappings(Slide, [
+        {"id": slide_id, "position": i * SLIDE_POSITION_GAP} for i, (slide_id,) in enumerate(rows)
+    ])
+    db.flush()
+    # 批量更新不刷新已加载对象，让会话中的 Slide 重新读取新的 position
+    db.expire_all()
+
+
+def _position_for_index(
+    db: Session, presentation_id: str, index: int, exclude_slide_id: Optional[str] = None
+) -> int:
+    """
+    计算放到第 index 张（未删除幻灯片中的序号）所需的 position：前一个邻居是第 index - 1 张未删除的幻灯片，
+    后一个邻居在全部幻灯片（含已删除）中取紧随其后的一行，新 position 不会与回收站中的幻灯片相同，恢复后也不会并列；
+    index 超出末尾时追加到最后。exclude_slide_id 用于移动时排除被移动的幻灯片本身。
+    """
+    index = max(0, index)
+    for _ in range(2):
+        prev_pos = None
+        if index > 0:
+            row = (
+                _active_slides_query(db, presentation_id, exclude_slide_id)
+                .with_entities(Slide.position)
+                .order_by(Slide.position)
+                .offset(index - 1)
+                .limit(1)
+                .first()
+            )
+            if row is None:
+                return _append_position(db, presentation_id, exclude_slide_id)
+            prev_pos = row[0]
+        q = db.query(func.min(Slide.position)).filter(Slide.presentation_id == presentation_id)
+        if exclude_slide_id is not None:
+            q = q.filter(Slide.id != exclude_slide_id)
+        if prev_pos is not None:
+            q = q.filter(Slide.position > prev_pos)
+        next_pos = q.scalar()
+        if next_pos is None:
+            return _append_position(db, presentation_id, exclude_slide_id)
+        if prev_pos is None:
+            return next_pos - SLIDE_POSITION_GAP
+        if next_pos - prev_pos >= 2:
+            return (prev_pos + next_pos) // 2
+        _rebalance_slide_positions(db, presentation_id)
+    raise RuntimeError(f"No slide position available at index {index} for {presentation_id}")
+
+
+def _append_position(db: Session, presentation_id: str, exclude_slide_id: Optional[str] = None) -> int:
+    """追加到末尾：排在所有幻灯片（含已删除）之后，避免与回收站中的幻灯片并列。"""
+    q = db.query(func.max(Slide.position)).filter(Slide.presentation_id == presentation_id)
+    if exclude_slide_id is not None:
+        q = q.filter(Slide.id != exclude_slide_id)
+    last = q.scalar()
+    return 0 if last is None else last + SLIDE_POSITION_GAP
 
 
 def add_slide_version(
@@ -468,16 +936,79 @@ def add_slide_version(
     base_image_path: Optional[str] = None,
 ) -> Optional[str]:
     """在指定 position 的幻灯片上增加一个版本；若该 position 无幻灯片则先创建幻灯片。返回 version_id。"""
+    version_id = _add_slide_version(db, presentation_id, slide_index, image_path, prompt, base_image_path)
+    db.commit()
+    return version_id
+
+
+def _add_slide_version(
+    db: Session,
+    presentation_id: str,
+    slide_index: int,
+    image_path: str,
+    prompt: str,
+    base_image_path: Optional[str] = None,
+) -> str:
+    """add_slide_version 的不提交版本，供单写者队列合并提交。"""
     slide = get_slide_by_position(db, presentation_id, slide_index)
     if not slide:
-        slide = Slide(
-            id=str(uuid.uuid4()),
-            presentation_id=presentation_id,
-            position=slide_index,
-        )
-        db.add(slide)
-        db.flush()
+        # 该序号还没有幻灯片：追加到末尾
+        slide = _new_slide_at_index(db, presentation_id, slide_index)
+    return _append_slide_version(db, presentation_id, slide, image_path, prompt, base_image_path)
+
+
+def _new_slide_at_index(db: Session, presentation_id: str, index: int) -> Slide:
+    slide = Slide(
+        id=str(uuid.uuid4()),
+        presentation_id=presentation_id,
+        position=_position_for_index(db, presentation_id, index),
+    )
+    db.add(slide)
+    db.flush()
+    return slide
 
+
+def _add_outline_item_slide_version(
+    db: Session,
+    presentation_id: str,
+    item_index: int,
+    image_path: str,
+    prompt: str,
+) -> str:
+    """
+    为大纲第 item_index 项生成的图片写入新版本（不提交），按大纲条目关联的幻灯片定位，而不是按条目序号：
+    条目已关联且幻灯片仍在时加到该幻灯片上；否则落在前一个已关联条目的幻灯片之后（没有则为第 0 张），
+    该处的幻灯片未被其他条目关联时在其上增加版本（重新生成已有的演示文稿），已被关联时在该处插入新幻灯片
+    （续跑中途失败的页，后面已生成的页不会被顶替）。
+    """
+    links = dict(
+        db.query(OutlineItem.item_index, OutlineItem.slide_id)
+        .filter(OutlineItem.presentation_id == presentation_id, OutlineItem.slide_id != None)
+        .all()
+    )
+    own_slide_id = links.pop(item_index, None)
+    slide = get_slide_by_id(db, presentation_id, own_slide_id) if own_slide_id else None
+    if not slide:
+        target = 0
+        for prev_index in sorted((i for i in links if i < item_index), reverse=True):
+            prev_slide = get_slide_by_id(db, presentation_id, links[prev_index])
+            if prev_slide:
+                target = get_slide_index(db, prev_slide) + 1
+                break
+        slide = get_slide_by_position(db, presentation_id, target)
+        if not slide or slide.id in links.values():
+            slide = _new_slide_at_index(db, presentation_id, target)
+    return _append_slide_version(db, presentation_id, slide, image_path, prompt)
+
+
+def _append_slide_version(
+    db: Session,
+    presentation_id: str,
+    slide: Slide,
+    image_path: str,
+    prompt: str,
+    base_image_path: Optional[str] = None,
+) -> str:
     version_number = (db.query(SlideVersion).filter(SlideVersion.slide_id == slide.id).count()) + 1
     version_id = str(uuid.uuid4())[:8]
     v = SlideVersion(
@@ -491,7 +1022,7 @@ def add_slide_version(
     db.add(v)
     slide.active_version_id = version_id
     slide.updated_at = datetime.now(timezone.utc)
-    db.commit()
+    _refresh_preview_image(db, presentation_id)
     return version_id
 
 
@@ -520,6 +1051,7 @@ def add_slide_version_by_slide_id(
     db.add(v)
     slide.active_version_id = version_id
     slide.updated_at = datetime.now(timezone.utc)
+    _refresh_preview_image(db, presentation_id)
     db.commit()
     return version_id
 
@@ -531,19 +1063,13 @@ def insert_slide_at_index(
     image_path: str,
     prompt: str,
 ) -> Optional[str]:
-    """在 target_index 插入一张新幻灯片，后续 position 后移。返回新幻灯片的第一个 version_id。"""
-    # 将 position >= target_index 的幻灯片后移
-    for s in db.query(Slide).filter(Slide.presentation_id == presentation_id).all():
-        if s.position >= target_index:
-            s.position += 1
-    db.flush()
-
+    """在 target_index 插入一张新幻灯片（取前后邻居 position 的中点，其余幻灯片不动）。返回新幻灯片的第一个 version_id。"""
     slide_id = str(uuid.uuid4())
     version_id = str(uuid.uuid4())[:8]
     slide = Slide(
         id=slide_id,
         presentation_id=presentation_id,
-        position=target_index,
+        position=_position_for_index(db, presentation_id, target_index),
         active_version_id=version_id,
     )
     db.add(slide)
@@ -556,6 +1082,7 @@ def insert_slide_at_index(
         version_number=1,
     )
     db.add(v)
+    _refresh_preview_image(db, presentation_id)
     db.commit()
     return version_id
 
@@ -564,58 +1091,135 @@ def delete_slide_at_index(db: Session, presentation_id: str, slide_index: int) -
     slide = get_slide_by_position(db, presentation_id, slide_index)
     if not slide:
         return False
+    # position 只用于排序，删除后无需前移后续幻灯片
     db.delete(slide)
-    # 后续 position 前移
-    for s in db.query(Slide).filter(Slide.presentation_id == presentation_id).all():
-        if s.position > slide_index:
-            s.position -= 1
+    _refresh_preview_image(db, presentation_id)
     db.commit()
     return True
 
 
-def delete_slide_by_id(db: Session, presentation_id: str, slide_id: str) -> bool:
-    slide = get_slide_by_id(db, presentation_id, slide_id)
+SLIDE_OPERATIONS = ("move", "delete", "restore", "activate")
+
+
+def _apply_slide_operation(
+    db: Session,
+    presentation_id: str,
+    op: str,
+    slide_id: str,
+    index: Optional[int] = None,
+    version_id: Optional[str] = None,
+) -> bool:
+    """
+    执行单个幻灯片操作但不提交：move（移动到第 index 张）、delete（软删除）、restore（从回收站恢复）、
+    activate（切换当前版本为 version_id）。幻灯片或版本不存在时返回 False。
+    """
+    slide = get_slide_by_id(db, presentation_id, slide_id, include_deleted=(op == "restore"))
     if not slide:
         return False
-    # 软删除，不重排 position
-    slide.deleted_at = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc)
+    if op == "move":
+        slide.position = _position_for_index(db, presentation_id, index or 0, exclude_slide_id=slide.id)
+    elif op == "delete":
+        # 软删除，不重排 position
+        slide.deleted_at = now
+    elif op == "restore":
+        slide.deleted_at = None
+    elif op == "activate":
+        exists = (
+            db.query(SlideVersion.id)
+            .filter(SlideVersion.id == version_id, SlideVersion.slide_id == slide.id)
+            .first()
+        )
+        if not exists:
+            return False
+        slide.active_version_id = version_id
+    else:
+        raise ValueError(f"Unsupported slide operation: {op}")
+    slide.updated_at = now
+    # 会话不自动 flush，后续操作的邻居查询需要看到本次改动
+    db.flush()
+    return True
+
+
+def _commit_slide_operation(db: Session, presentation_id: str, op: str, slide_id: str, **kwargs) -> bool:
+    if not _apply_slide_operation(db, presentation_id, op, slide_id, **kwargs):
+        return False
+    _refresh_preview_image(db, presentation_id)
     db.commit()
     return True
 
 
+def delete_slide_by_id(db: Session, presentation_id: str, slide_id: str) -> bool:
+    return _commit_slide_operation(db, presentation_id, "delete", slide_id)
+
+
+def move_slide(db: Session, presentation_id: str, slide_id: str, target_index: int) -> bool:
+    """把幻灯片移动到第 target_index 张（未删除幻灯片中的序号），只更新被移动的一行。"""
+    return _commit_slide_operation(db, presentation_id, "move", slide_id, index=target_index)
+
+
+def apply_slide_operations(db: Session, presentation_id: str, operations: List[dict]) -> List[dict]:
+    """
+    在一个事务中按顺序执行一组幻灯片操作（每项含 op、slide_id 及 move 的 index / activate 的 version_id），
+    全部成功才提交，封面只重算一次。任一项的幻灯片或版本不存在时回滚并抛出 ValueError。
+    返回操作后的幻灯片顺序 [{slide_id, index, active_version_id}]。
+    """
+    for i, item in enumerate(operations):
+        ok = _apply_slide_operation(
+            db,
+            presentation_id,
+            item["op"],
+            item["slide_id"],
+            index=item.get("index"),
+            version_id=item.get("version_id"),
+        )
+        if not ok:
+            db.rollback()
+            raise ValueError(f"Operation {i} ({item['op']}): slide or version not found")
+    _refresh_preview_image(db, presentation_id)
+    db.commit()
+    slides = _active_slides_query(db, presentation_id).order_by(Slide.position).all()
+    active, _ = _load_active_versions(db, slides)
+    return [
+        {"slide_id": s.id, "index": i, "active_version_id": active[s.id].id if s.id in active else None}
+        for i, s in enumerate(slides)
+    ]
+
+
 def list_deleted_slides(db: Session, presentation_id: str) -> List[dict]:
-    """返回当前演示文稿下已软删除的幻灯片列表（用于回收站恢复）。"""
+    """
+    返回当前演示文稿下已软删除的幻灯片列表（用于回收站恢复），index 为恢复后所在的序号；
+    序号由同一条查询中的相关子查询沿索引计数，版本历史一次批量加载，不再逐行查询。
+    """
+    active = aliased(Slide)
+    restored_index = (
+        db.query(func.count(active.id))
+        .filter(
+            active.presentation_id == Slide.presentation_id,
+            active.deleted_at == None,
+            active.position < Slide.position,
+        )
+        .correlate(Slide)
+        .scalar_subquery()
+    )
     rows = (
-        db.query(Slide)
+        db.query(Slide, restored_index)
+        .options(selectinload(Slide.versions))
         .filter(
             and_(Slide.presentation_id == presentation_id, Slide.deleted_at != None)
         )
         .order_by(Slide.deleted_at.desc())
         .all()
     )
-    return [_slide_to_dict(s) for s in rows]
+    return [_slide_to_dict(s, index) for s, index in rows]
 
 
 def restore_slide(db: Session, presentation_id: str, slide_id: str) -> bool:
-    slide = get_slide_by_id(db, presentation_id, slide_id, include_deleted=True)
-    if not slide:
-        return False
-    slide.deleted_at = None
-    db.commit()
-    return True
+    return _commit_slide_operation(db, presentation_id, "restore", slide_id)
 
 
 def set_slide_active_version(db: Session, presentation_id: str, slide_id: str, version_id: str) -> bool:
-    slide = get_slide_by_id(db, presentation_id, slide_id)
-    if not slide:
-        return False
-    exists = any(v.id == version_id for v in slide.versions)
-    if not exists:
-        return False
-    slide.active_version_id = version_id
-    slide.updated_at = datetime.now(timezone.utc)
-    db.commit()
-    return True
+    return _commit_slide_operation(db, presentation_id, "activate", slide_id, version_id=version_id)
 
 
 def delete_slide_version(db: Session, presentation_id: str, slide_id: str, version_id: str) -> bool:
@@ -630,6 +1234,7 @@ def delete_slide_version(db: Session, presentation_id: str, slide_id: str, versi
         if remaining:
             slide.active_version_id = remaining[-1].id
     db.delete(v)
+    _refresh_preview_image(db, presentation_id)
     db.commit()
     return True
 
@@ -643,29 +1248,31 @@ def get_previous_slide_prompt(
 ) -> Optional[str]:
     """取「上一张」幻灯片的 prompt。可用 current_position（可见列表中的索引）或 slide_id 指定当前张。"""
     if slide_id is not None:
-        rows = (
-            db.query(Slide)
-            .filter(
-                and_(Slide.presentation_id == presentation_id, Slide.deleted_at == None)
-            )
-            .order_by(Slide.position)
-            .all()
-        )
-        try:
-            idx = next(i for i, s in enumerate(rows) if s.id == slide_id)
-        except StopIteration:
-            return None
-        if idx <= 0:
+        current = get_slide_by_id(db, presentation_id, slide_id)
+        if not current:
             return None
-        prev = rows[idx - 1]
+        # 按 position 取紧邻的上一张
+        prev = (
+            _active_slides_query(db, presentation_id)
+            .filter(Slide.position < current.position)
+            .order_by(Slide.position.desc())
+            .limit(1)
+            .first()
+        )
     else:
         if current_position is None or current_position <= 0:
             return None
         prev = get_slide_by_position(db, presentation_id, current_position - 1)
-    if not prev or not prev.versions:
+    if not prev:
         return None
-    active = next((x for x in prev.versions if x.id == prev.active_version_id), None) or prev.versions[-1]
-    return active.prompt
+    active, _ = _load_active_versions(db, [prev])
+    v = active.get(prev.id)
+    return v.prompt if v else None
+
+
+def get_version_slide_id(db: Session, version_id: str) -> Optional[str]:
+    """按版本 id 取所属幻灯片 id（主键查询，不加载关系）。"""
+    return db.query(SlideVersion.slide_id).filter(SlideVersion.id == version_id).scalar()
 
 
 def get_slide_context_messages(db: Session, presentation_id: str, slide_id: str) -> list:
@@ -752,10 +1359,15 @@ def get_user_scores(db: Session, user_id: str) -> int:
 
 
 def deduct_scores(db: Session, user_id: str, amount: int) -> bool:
-    u = db.query(User).filter(User.id == user_id).first()
-    if not u or u.scores < amount:
+    """条件 UPDATE 扣减积分：余额不足时不命中任何行，并发扣减不会透支。"""
+    n = (
+        db.query(User)
+        .filter(User.id == user_id, User.scores >= amount)
+        .update({User.scores: User.scores - amount}, synchronize_session=False)
+    )
+    if not n:
+        db.rollback()
         return False
-    u.scores -= amount
     db.commit()
     return True
 
@@ -804,6 +1416,318 @@ def get_register_bonus_scores(db: Session) -> int:
         return 50
 
 
+def get_planner_stage_models(db: Session) -> dict:
+    """获取规划器按阶段的模型覆盖配置（JSON 对象，如 {"keywords": "gemini-2.5-flash"}），默认空。"""
+    v = get_config(db, "planner_stage_models")
+    if not v:
+        return {}
+    try:
+        data = json.loads(v)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# ---------- Credit Reservations (积分预留) ----------
+
+
+def _credit_reservation_to_dict(r: CreditReservation) -> dict:
+    return {
+        "id": r.id,
+        "user_id": r.user_id,
+        "presentation_id": r.presentation_id,
+        "reserved": r.reserved,
+        "consumed": r.consumed or 0,
+        "status": r.status,
+    }
+
+
+def reserve_scores(db: Session, user_id: str, amount: int, presentation_id: Optional[str] = None) -> Optional[str]:
+    """
+    批量生成受理时冻结 amount 积分：一条条件 UPDATE 从余额中扣除，与预留记录在同一事务提交。
+    余额不足返回 None；并发受理的多套演示文稿合计不会透支。
+    """
+    n = (
+        db.query(User)
+        .filter(User.id == user_id, User.scores >= amount)
+        .update({User.scores: User.scores - amount}, synchronize_session=False)
+    )
+    if not n:
+        db.rollback()
+        return None
+    reservation = CreditReservation(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        presentation_id=presentation_id,
+        reserved=amount,
+        consumed=0,
+        status="held",
+    )
+    db.add(reservation)
+    db.commit()
+    return reservation.id
+
+
+def get_credit_reservation(db: Session, reservation_id: str) -> Optional[dict]:
+    r = db.query(CreditReservation).filter(CreditReservation.id == reservation_id).first()
+    return _credit_reservation_to_dict(r) if r else None
+
+
+def settle_reserved_scores(
+    db: Session,
+    reservation_id: str,
+    user_id: str,
+    amount: int,
+    balance: Optional[int] = None,
+    prompt: Optional[str] = None,
+    image_path: Optional[str] = None,
+) -> bool:
+    """
+    从预留中结算一页：累加 consumed 与写入消费日志在同一事务提交，不再读写 users.scores。
+    预留已释放或剩余不足时返回 False，调用方可改用 deduct_scores 直接扣减。
+    """
+    if not _settle_reserved_scores(db, reservation_id, user_id, amount, balance, prompt, image_path):
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+
+def _settle_reserved_scores(
+    db: Session,
+    reservation_id: str,
+    user_id: str,
+    amount: int,
+    balance: Optional[int] = None,
+    prompt: Optional[str] = None,
+    image_path: Optional[str] = None,
+) -> bool:
+    """settle_reserved_scores 的不提交版本；未命中预留时不做任何修改。"""
+    n = (
+        db.query(CreditReservation)
+        .filter(
+            CreditReservation.id == reservation_id,
+            CreditReservation.status == "held",
+            CreditReservation.consumed + amount <= CreditReservation.reserved,
+        )
+        .update(
+            {
+                CreditReservation.consumed: CreditReservation.consumed + amount,
+                CreditReservation.updated_at: datetime.now(timezone.utc),
+            },
+            synchronize_session=False,
+        )
+    )
+    if not n:
+        return False
+    db.add(ScoreLog(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        amount=amount,
+        balance=balance,
+        prompt=prompt[:500] if prompt else prompt,
+        image_path=image_path,
+        log_type="consume",
+    ))
+    return True
+
+
+def release_reserved_scores(db: Session, reservation_id: str) -> int:
+    """
+    结束预留并把未结算的部分退回余额，返回退回的积分数。
+    先以条件 UPDATE 把状态从 held 改为 released，之后的结算都会失败，重复释放也只退一次。
+    """
+    n = (
+        db.query(CreditReservation)
+        .filter(CreditReservation.id == reservation_id, CreditReservation.status == "held")
+        .update(
+            {CreditReservation.status: "released", CreditReservation.updated_at: datetime.now(timezone.utc)},
+            synchronize_session=False,
+        )
+    )
+    if not n:
+        db.rollback()
+        return 0
+    user_id, reserved, consumed = (
+        db.query(CreditReservation.user_id, CreditReservation.reserved, CreditReservation.consumed)
+        .filter(CreditReservation.id == reservation_id)
+        .one()
+    )
+    unused = max(0, reserved - (consumed or 0))
+    if unused:
+        db.query(User).filter(User.id == user_id).update(
+            {User.scores: User.scores + unused}, synchronize_session=False
+        )
+    db.commit()
+    return unused
+
+
+def touch_credit_reservations(db: Session, reservation_ids: Iterable[str]) -> int:
+    """刷新仍在使用的预留的 updated_at（本地队列中排队或执行中的任务），使其不被任何进程的清扫视为过期，返回更新条数。"""
+    ids = list(reservation_ids)
+    if not ids:
+        return 0
+    n = (
+        db.query(CreditReservation)
+        .filter(CreditReservation.id.in_(ids), CreditReservation.status == "held")
+        .update({CreditReservation.updated_at: datetime.now(timezone.utc)}, synchronize_session=False)
+    )
+    db.commit()
+    return n
+
+
+def release_stale_reservations(db: Session, idle_seconds: int, exclude_ids: Iterable[str] = ()) -> int:
+    """
+    释放超过 idle_seconds 未结算、且没有排队或执行中任务引用的预留（执行进程崩溃后遗留），返回释放条数。
+    exclude_ids 为调用进程内仍在使用的预留（本地队列的任务不写 generation_jobs），一并跳过。
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=idle_seconds)
+    active_jobs = (
+        db.query(GenerationJob.reservation_id)
+        .filter(GenerationJob.status.in_(("queued", "running")), GenerationJob.reservation_id.isnot(None))
+    )
+    q = (
+        db.query(CreditReservation.id)
+        .filter(
+            CreditReservation.status == "held",
+            CreditReservation.updated_at < cutoff,
+            CreditReservation.id.notin_(active_jobs),
+        )
+    )
+    exclude_ids = list(exclude_ids)
+    if exclude_ids:
+        q = q.filter(CreditReservation.id.notin_(exclude_ids))
+    rows = q.all()
+    released = 0
+    for (reservation_id,) in rows:
+        release_reserved_scores(db, reservation_id)
+        released += 1
+    return released
+
+
+# ---------- Generation Jobs (生成任务队列) ----------
+
+
+def _generation_job_to_dict(j: GenerationJob) -> dict:
+    return {
+        "id": j.id,
+        "presentation_id": j.presentation_id,
+        "user_id": j.user_id,
+        "slides": json.loads(j.slides) if j.slides else [],
+        "status": j.status,
+        "lease_owner": j.lease_owner,
+        "attempts": j.attempts or 0,
+        "error": j.error,
+        "reservation_id": j.reservation_id,
+    }
+
+
+def enqueue_generation_job(
+    db: Session,
+    presentation_id: str,
+    slides: list,
+    user_id: Optional[str] = None,
+    reservation_id: Optional[str] = None,
+) -> str:
+    """写入一条待领取的生成任务，返回 job_id。reservation_id 为受理时冻结积分的预留。"""
+    job = GenerationJob(
+        id=str(uuid.uuid4()),
+        presentation_id=presentation_id,
+        user_id=user_id,
+        slides=json.dumps(slides, ensure_ascii=False),
+        status="queued",
+        reservation_id=reservation_id,
+    )
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def lease_generation_job(db: Session, owner: str, lease_seconds: int) -> Optional[dict]:
+    """
+    领取最早的一条待执行任务（queued，或租约已过期的 running）。
+    以带条件的 UPDATE 抢占，多个 worker 并发领取同一条时只有一个成功。
+    """
+    now = datetime.now(timezone.utc)
+    claimable = or_(
+        GenerationJob.status == "queued",
+        and_(GenerationJob.status == "running", GenerationJob.lease_expires_at < now),
+    )
+    candidates = (
+        db.query(GenerationJob.id)
+        .filter(claimable)
+        .order_by(GenerationJob.created_at)
+        .limit(5)
+        .all()
+    )
+    for (job_id,) in candidates:
+        won = (
+            db.query(GenerationJob)
+            .filter(GenerationJob.id == job_id, claimable)
+            .update(
+                {
+                    GenerationJob.status: "running",
+                    GenerationJob.lease_owner: owner,
+                    GenerationJob.lease_expires_at: now + timedelta(seconds=lease_seconds),
+                    GenerationJob.attempts: GenerationJob.attempts + 1,
+                    GenerationJob.updated_at: now,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if won:
+            job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+            return _generation_job_to_dict(job) if job else None
+    return None
+
+
+def renew_generation_job(db: Session, job_id: str, owner: str, lease_seconds: int) -> bool:
+    """
+    续租；租约已被其他 worker 接手时返回 False。
+    只更新租约，不写回 slides：已生成的页以 outline_items.status 为准，接手的 worker 据此跳过。
+    """
+    now = datetime.now(timezone.utc)
+    n = (
+        db.query(GenerationJob)
+        .filter(GenerationJob.id == job_id, GenerationJob.lease_owner == owner, GenerationJob.status == "running")
+        .update(
+            {
+                GenerationJob.lease_expires_at: now + timedelta(seconds=lease_seconds),
+                GenerationJob.updated_at: now,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return n > 0
+
+
+def finish_generation_job(db: Session, job_id: str, owner: str, status: str, error: Optional[str] = None) -> bool:
+    """结束任务（completed / failed）；仅当前持有租约的 worker 可结束。"""
+    n = (
+        db.query(GenerationJob)
+        .filter(GenerationJob.id == job_id, GenerationJob.lease_owner == owner)
+        .update(
+            {
+                GenerationJob.status: status,
+                GenerationJob.error: error,
+                GenerationJob.lease_expires_at: None,
+                GenerationJob.updated_at: datetime.now(timezone.utc),
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return n > 0
+
+
+def count_generation_jobs(db: Session) -> dict:
+    """按状态统计生成任务数。"""
+    rows = db.query(GenerationJob.status, func.count(GenerationJob.id)).group_by(GenerationJob.status).all()
+    return {status: count for status, count in rows}
+
+
 # ---------- Score Logs (积分日志) ----------
 
 
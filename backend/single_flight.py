@@ -0,0 +1,56 @@
+"""
+请求合并（single-flight）：相同 key 的并发请求只执行一次，重复请求挂到同一个进行中的任务上并共享结果。
+用于 /plan、/generate-from-outline 等耗时且按输入幂等的接口，避免双击或客户端重试重复消耗 LLM 调用。
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+def make_flight_key(namespace: str, presentation_id: str, payload: Any) -> str:
+    """按演示文稿 id 与输入内容生成合并 key：payload 以排序后的 JSON 计算 sha256。"""
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return f"{namespace}:{presentation_id}:{digest}"
+
+
+class SingleFlight:
+    """
+    同一事件循环内的请求合并器。
+
+    do(key, fn) 在 key 无进行中任务时以 fn() 创建任务，否则等待已有任务；
+    返回 (result, shared)，shared 为 True 表示结果来自其他请求发起的任务。
+    任务独立于发起请求运行，发起方断开不会取消任务，其他等待方仍可拿到结果。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        task, shared = self._get_or_start(key, fn)
+        return await asyncio.shield(task), shared
+
+    def start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> bool:
+        """启动任务但不等待结果（需在事件循环中调用）；返回 True 表示已有相同任务在进行。"""
+        _, shared = self._get_or_start(key, fn)
+        return shared
+
+    def _get_or_start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[asyncio.Task, bool]:
+        task = self._inflight.get(key)
+        if task is not None:
+            return task, True
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        return task, False
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有等待方都已断开时也要取走异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
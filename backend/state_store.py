@@ -0,0 +1,214 @@
+"""
+短期状态存储：规划进度、规划结果等按 (namespace, key) 存放的 JSON 状态，带 TTL 过期与容量上限。
+
+后端通过 STATE_STORE_URL 选择：
+- memory://（单 worker 默认）：进程内 LRU；
+- sqlite:///path/to/state.db：同机多进程共享（sqlite:// 即 storage/state.db，WEB_CONCURRENCY > 1 时默认）；
+- redis://host:6379/0：跨进程/跨节点共享，需安装可选依赖 redis，兼容 Redis 协议的服务均可。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional
+
+DEFAULT_TTL = int(os.getenv("STATE_TTL_SECONDS", str(6 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(__file__), "storage", "state.db")
+
+
+class StateStore(ABC):
+    """状态存储接口：值为可 JSON 序列化的对象，ttl 为秒（None 表示使用默认 TTL）。未实现全部抽象方法的后端无法实例化。"""
+
+    # 是否跨进程可见
+    shared = False
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> None:
+        ...
+
+    def map(self, namespace: str, ttl: Optional[int] = None) -> "StateMap":
+        return StateMap(self, namespace, ttl)
+
+
+class MemoryStateStore(StateStore):
+    """进程内 LRU：超过 max_entries 淘汰最久未写入的条目，读取时惰性清理过期条目。"""
+
+    def __init__(self, ttl: int = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._data[(namespace, key)]
+                return None
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._data[(namespace, key)] = (expires_at, value)
+            self._data.move_to_end((namespace, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+
+class SQLiteStateStore(StateStore):
+    """基于 SQLite 文件的共享存储：同机多个 uvicorn worker 可见，写入时顺带清理过期与超量条目。"""
+
+    shared = True
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, ttl: int = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS state_entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_state_entries_expires ON state_entries(expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_state_entries_updated ON state_entries(updated_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM state_entries WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO state_entries (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, "
+            "expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+            (namespace, key, json.dumps(value, ensure_ascii=False), now + (ttl or self.ttl), now),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM state_entries WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM state_entries WHERE rowid IN ("
+            "SELECT rowid FROM state_entries ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, namespace, key):
+        self._conn().execute("DELETE FROM state_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+
+class RedisStateStore(StateStore):
+    """Redis 协议存储：过期交给 EX，容量上限交给服务端 maxmemory 策略。"""
+
+    shared = True
+
+    def __init__(self, url: str, ttl: int = DEFAULT_TTL, prefix: str = "geekai-ppt"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_STORE_URL 使用 redis:// 需要安装可选依赖：pip install redis") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace, key):
+        raw = self.client.get(self._key(namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace, key, value, ttl=None):
+        self.client.set(self._key(namespace, key), json.dumps(value, ensure_ascii=False), ex=ttl or self.ttl)
+
+    def delete(self, namespace, key):
+        self.client.delete(self._key(namespace, key))
+
+
+class StateMap:
+    """按 namespace 的字典视图，保留 PLAN_PROGRESS[pid] 这类用法。"""
+
+    def __init__(self, store: StateStore, namespace: str, ttl: Optional[int] = None):
+        self.store = store
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.store.get(self.namespace, key)
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.store.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.store.set(self.namespace, key, value, ttl=self.ttl)
+
+    def __contains__(self, key: str) -> bool:
+        return self.store.get(self.namespace, key) is not None
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        value = self.get(key, default)
+        self.store.delete(self.namespace, key)
+        return value
+
+
+def create_state_store(url: Optional[str] = None) -> StateStore:
+    """根据 STATE_STORE_URL 创建状态存储；未配置且 WEB_CONCURRENCY > 1 时默认使用同机共享的 SQLite。"""
+    if url is None:
+        url = os.getenv("STATE_STORE_URL", "")
+        if not url:
+            url = "sqlite://" if int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1 else "memory://"
+    if not url or url.startswith("memory://"):
+        return MemoryStateStore()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else ""
+        return SQLiteStateStore(path or DEFAULT_SQLITE_PATH)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateStore(url)
+    raise ValueError(f"Unsupported STATE_STORE_URL: {url}")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+独立生成 worker：从 generation_jobs 队列领取任务，运行生成流水线，进度写回数据库并经共享状态存储推送给 API 的 SSE。
+
+用法（在 backend 目录执行，与 API 共用 storage 目录与 .env）：
+    python worker.py --concurrency 2
+
+API 与 worker 均需设置 GENERATION_QUEUE=db；STATE_STORE_URL 使用 sqlite:// 或 redis://，SSE 才能收到 worker 发布的进度。
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import run_migrations
+from gallery_cache import GalleryCache, install_invalidation
+from image_gen import ImageGenerator
+from job_queue import DBJobQueue, start_credit_hold_sweeper
+from progress_bus import ProgressBus
+from state_store import create_state_store
+
+# 队列为空时的轮询间隔（秒）
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+
+
+def _work_loop(queue: DBJobQueue, owner: str, image_gen: ImageGenerator, bus: ProgressBus, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            if queue.run_one(owner, image_gen, bus):
+                continue
+        except Exception as e:
+            print(f"[{owner}] run job failed: {e}")
+        stop.wait(POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GeekAI-PPT 生成 worker")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "2")),
+                        help="同时处理的演示文稿数")
+    args = parser.parse_args()
+
+    run_migrations()
+    store = create_state_store()
+    if not store.shared:
+        print("Warning: STATE_STORE_URL is not shared; SSE clients will only see progress persisted to the database")
+    bus = ProgressBus(store=store)
+    # worker 只负责失效：生成新版本后换新代号，API 侧缓存随即失效
+    install_invalidation(GalleryCache(store, store))
+    image_gen = ImageGenerator()
+    queue = DBJobQueue()
+
+    stop = threading.Event()
+
+    def _shutdown(signum, _frame):
+        print(f"Received signal {signum}, finishing current jobs...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+    start_credit_hold_sweeper(stop)
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=_work_loop, args=(queue, f"{prefix}:{i}", image_gen, bus, stop), name=f"worker-{i}")
+        for i in range(max(1, args.concurrency))
+    ]
+    for t in threads:
+        t.start()
+    print(f"Generation worker {prefix} started with {len(threads)} slot(s)")
+    for t in threads:
+        t.join()
+    print("Generation worker stopped")
+
+
+if __name__ == "__main__":
+    main()
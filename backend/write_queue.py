@@ -0,0 +1,122 @@
+"""
+单写者队列：生成流水线的写操作交给一个专用线程串行执行，排队中的多个写操作合并为一次提交（组提交）。
+
+SQLite 同一时刻只允许一个写事务，多个生成线程各自提交时会在写锁上排队，甚至超过 busy_timeout 报 database is locked；
+交给单写者后不再争抢写锁，一次 fsync 提交一批写入，读请求在 WAL 下不受影响。
+
+写操作 op(db) 只修改会话、不提交（repository 中以下划线开头的不提交版本），返回值应为普通值（id、bool 等）。
+同批中任一操作失败时整批回滚，再逐个重试并各自提交，失败的操作只影响自己的调用方。
+"""
+import atexit
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+# 一次组提交最多合并的写操作数
+MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "64"))
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    submit(op) 返回 Future，run(op) 阻塞等待结果；写线程在第一次提交时启动。
+    session_factory 默认为 SessionLocal（基准测试可传入指向临时库的会话工厂）。
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, max_batch: int = MAX_BATCH):
+        self.session_factory = session_factory
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # 统计：提交次数与已执行的写操作数
+        self.commits = 0
+        self.ops = 0
+
+    def submit(self, op: Callable[[Session], Any]) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        self._queue.put((op, future))
+        return future
+
+    def run(self, op: Callable[[Session], Any]) -> Any:
+        return self.submit(op).result()
+
+    def close(self) -> None:
+        """执行完已排队的写操作后停止写线程。"""
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+            if stopping:
+                return
+
+    def _commit_batch(self, batch: List[Tuple[Callable[[Session], Any], Future]]) -> None:
+        db = self.session_factory()
+        try:
+            results = []
+            try:
+                for op, _ in batch:
+                    results.append(op(db))
+                    # 会话关闭了 autoflush：逐个 flush，后面的操作才能查到前面写入的行
+                    db.flush()
+                db.commit()
+            except Exception:
+                db.rollback()
+                if len(batch) == 1:
+                    raise
+                results = None
+            if results is not None:
+                self.commits += 1
+                self.ops += len(batch)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+                return
+            # 整批失败：逐个重试，找出出错的操作
+            for op, future in batch:
+                try:
+                    result = op(db)
+                    db.commit()
+                    self.commits += 1
+                    self.ops += 1
+                    future.set_result(result)
+                except Exception as e:
+                    db.rollback()
+                    future.set_exception(e)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            db.close()
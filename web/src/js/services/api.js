@@ -2,7 +2,7 @@
 // 将 TypeScript fetch API 转换为 JavaScript axios 调用
 
 import { httpGet, httpPost, httpDelete, httpPatch } from '../utils/http'
-import { setAdminToken } from '../cache/session'
+import { setAdminToken, getUserToken } from '../cache/session'
 import { API_BASE_URL } from '@/config'
 
 // 未授权回调
@@ -275,9 +275,12 @@ export async function createPresentation(topic) {
   }
 }
 
-export async function getPresentation(presentationId) {
+// view：'summary' 每页只带当前版本，'full' 带完整版本历史
+export async function getPresentation(presentationId, view = 'full') {
   try {
-    return await httpGet(buildUrl(`/presentations/${presentationId}`))
+    return await httpGet(
+      buildUrl(`/presentations/${presentationId}?view=${view}`),
+    )
   } catch (error) {
     handleErrorResponse(error)
   }
@@ -344,10 +347,15 @@ export async function publishPresentation(presentationId) {
   }
 }
 
-export async function listGalleryPresentations(skip = 0, limit = 20) {
+// 作品广场游标分页：传入上一页的 next_cursor，返回 { presentations, next_cursor }
+export async function listGalleryPresentations(cursor = null, limit = 20) {
   try {
-    const response = await httpGet(buildUrl('/gallery'), { skip, limit })
-    return response.presentations || response
+    const params = cursor ? { cursor, limit } : { limit }
+    const response = await httpGet(buildUrl('/gallery'), params)
+    return {
+      presentations: response.presentations || [],
+      next_cursor: response.next_cursor || null,
+    }
   } catch (error) {
     handleErrorResponse(error)
   }
@@ -393,6 +401,18 @@ export async function restoreSlide(presentationId, slideId) {
   }
 }
 
+// 调整幻灯片顺序：移动到第 index 张（未删除幻灯片中的序号）
+export async function moveSlide(presentationId, slideId, index) {
+  try {
+    return await httpPatch(
+      buildUrl(`/presentations/${presentationId}/slides/${slideId}/position`),
+      { index },
+    )
+  } catch (error) {
+    handleErrorResponse(error)
+  }
+}
+
 export async function setActiveVersion(presentationId, slideId, versionId) {
   try {
     return await httpPatch(
@@ -475,9 +495,24 @@ export async function planPPT(request) {
   }
 }
 
+// 规划状态与结果：请求中断后用于取回后台已完成的大纲
+export async function getPlanResult(presentationId) {
+  try {
+    return await httpGet(buildUrl(`/presentations/${presentationId}/plan`))
+  } catch (error) {
+    handleErrorResponse(error)
+  }
+}
+
+// EventSource 无法设置请求头，token 通过查询参数传递
+function streamUrl(endpoint) {
+  const token = (getUserToken() || '').replace(/^Bearer /, '')
+  return `${API_BASE_URL || ''}${endpoint}?token=${encodeURIComponent(token)}`
+}
+
 export function getPlanProgressStream(presentationId) {
   return new EventSource(
-    `${API_BASE_URL || ''}/presentations/${presentationId}/plan-progress`,
+    streamUrl(`/presentations/${presentationId}/plan-progress`),
   )
 }
 
@@ -557,6 +592,12 @@ export async function getGenerationProgress(presentationId) {
   }
 }
 
+export function getGenerationProgressStream(presentationId) {
+  return new EventSource(
+    streamUrl(`/presentations/${presentationId}/generation-stream`),
+  )
+}
+
 // ============ 文件 ============
 export async function uploadDoc(file) {
   try {
@@ -1,19 +1,27 @@
 import { defineStore } from 'pinia'
 import * as api from '@/js/services/api'
 
+function normalizeVersions(list) {
+  return (list ?? []).map((v) => ({
+    id: v.id,
+    url: api.getImageUrl(v.image_url) || v.image_url || '',
+    prompt: v.prompt,
+  }))
+}
+
 function normalizeSlides(payload) {
   const list = payload?.slides ?? []
   return list.map((s) => {
-    const versions = (s.versions ?? []).map((v) => ({
-      id: v.id,
-      url: api.getImageUrl(v.image_url) || v.image_url || '',
-      prompt: v.prompt,
-    }))
+    const versions = normalizeVersions(s.versions)
     const activeVersionId = s.active_version_id ?? (versions[versions.length - 1]?.id ?? null)
+    const versionCount = s.version_count ?? versions.length
     return {
       slideId: s.slide_id,
       activeVersionId,
       versions,
+      versionCount,
+      // summary 视图只带当前版本，完整历史在打开版本面板时按需加载
+      versionsLoaded: versions.length >= versionCount,
     }
   })
 }
@@ -47,7 +55,7 @@ export const useSlidesStore = defineStore('slides', {
       this.currentIndex = Math.max(0, Math.min(index, this.slides.length - 1))
     },
     async loadSession(sessionId) {
-      const detail = await api.getPresentation(sessionId)
+      const detail = await api.getPresentation(sessionId, 'summary')
       this.presentationId = detail?.id ?? sessionId
       this.sessionTitle = detail?.title ?? detail?.topic ?? 'Untitled'
       this.slides = normalizeSlides(detail)
@@ -55,6 +63,14 @@ export const useSlidesStore = defineStore('slides', {
         this.currentIndex = Math.max(0, this.slides.length - 1)
       }
     },
+    async loadSlideVersions(slideId) {
+      const slide = this.slides.find((s) => s.slideId === slideId)
+      if (!slide || slide.versionsLoaded || !this.presentationId) return
+      const res = await api.listVersions(this.presentationId, slideId)
+      slide.versions = normalizeVersions(res?.versions)
+      slide.versionCount = slide.versions.length
+      slide.versionsLoaded = true
+    },
     reorderSlides(fromIndex, toIndex) {
       const arr = [...this.slides]
       const [item] = arr.splice(fromIndex, 1)
@@ -68,6 +84,80 @@ export const useSlidesStore = defineStore('slides', {
         this.currentIndex++
       }
     },
+    applyGenerationProgress(progress) {
+      this.isGenerating = true
+      this.generationStatus = 'generating'
+      this.totalSlides = progress.total ?? 0
+      this.currentSlideIndex = progress.current ?? 0
+      this.generationProgress = progress.percentage ?? 0
+    },
+    applySlideDone(evt) {
+      const version = {
+        id: evt.version_id,
+        url: api.getImageUrl(evt.image_url) || evt.image_url || '',
+        prompt: evt.prompt,
+      }
+      const existing = this.slides.find((s) => s.slideId === evt.slide_id)
+      if (existing) {
+        existing.versions.push(version)
+        existing.versionCount = (existing.versionCount ?? 0) + 1
+        existing.activeVersionId = version.id
+      } else {
+        const slide = {
+          slideId: evt.slide_id,
+          activeVersionId: version.id,
+          versions: [version],
+          versionCount: 1,
+          versionsLoaded: true,
+        }
+        this.slides.splice(Math.min(evt.index ?? this.slides.length, this.slides.length), 0, slide)
+      }
+      const total = evt.total ?? this.totalSlides
+      this.applyGenerationProgress({
+        current: evt.current,
+        total,
+        percentage: total ? Math.floor(((evt.current ?? 0) / total) * 100) : 0,
+      })
+    },
+    // 订阅服务端推送的生成进度；连接失败时回退为轮询
+    watchUntilCompleted(sessionId) {
+      return new Promise((resolve, reject) => {
+        let settled = false
+        const stream = api.getGenerationProgressStream(sessionId)
+        const finish = (result) => {
+          if (settled) return
+          settled = true
+          stream.close()
+          resolve(result)
+        }
+        const fallback = () => {
+          if (settled) return
+          settled = true
+          stream.close()
+          this.pollUntilCompleted(sessionId).then(resolve, reject)
+        }
+        const parse = (evt) => {
+          try {
+            return JSON.parse(evt.data || '{}')
+          } catch (error) {
+            return {}
+          }
+        }
+        stream.addEventListener('progress', (evt) => {
+          const data = parse(evt)
+          if (data.status === 'generating') {
+            this.applyGenerationProgress(data)
+          } else if (data.status !== 'idle') {
+            finish(data)
+          }
+        })
+        stream.addEventListener('slide_done', (evt) => this.applySlideDone(parse(evt)))
+        stream.addEventListener('completed', (evt) => finish(parse(evt)))
+        stream.addEventListener('failed', (evt) => finish(parse(evt)))
+        stream.addEventListener('timeout', fallback)
+        stream.onerror = fallback
+      })
+    },
     async pollUntilCompleted(sessionId) {
       const poll = async () => {
         const progress = await api.getGenerationProgress(sessionId)